@@ -4,12 +4,9 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, talib, set_trace
 from datetime import timedelta
-import talib
 from backtester import Backtester
-from IPython.core.debugger import set_trace
 
 class ATRMomentum(Backtester):
     '''
@@ -73,52 +70,24 @@ class ATRMomentum(Backtester):
         a set of stances
         '''
 
-        ATR = talib.ATR(self._df['high'], self._df['low'], self._df['last'], timeperiod=self._lookback)
+        ATR = self._cached('atr', (self._lookback,),
+            lambda: talib.ATR(self._df['high'], self._df['low'], self._df['last'], timeperiod=self._lookback),
+            columns=('high', 'low', 'last'))
         #set_trace()
 
-        self._df['middle'] = self._df['last'].rolling(window=self._lookback).mean()
+        self._df['middle'] = self._cached('rolling_mean', (self._lookback,), lambda: self._df['last'].rolling(window=self._lookback).mean())
         self._df['upper'] = self._df['middle'] + (self._distance * ATR)
         self._df['lower'] = self._df['middle'] - (self._distance * ATR)
         
-        current_stance = 0
-        stances = []
-
-
-        for index in np.arange(0,len(self._df)):
-
-            long_signal = False
-            short_signal = False
-            long_close = False
-            short_close = False
-            close = self._df['last'].iloc[index]
-            
-            if close >= self._df['upper'].iloc[index]:
-                long_signal = True
-
-            if close < self._df['lower'].iloc[index]:
-                short_signal = True
-
-            if close <= self._df['middle'].iloc[index]:
-                long_close = True
-
-            if close >= self._df['middle'].iloc[index]:
-                short_close = True
-
-            if current_stance == 0:
-                if long_signal:
-                    current_stance = 1
-                elif short_signal:
-                    current_stance = -1
-            elif current_stance == 1:
-                if long_close:
-                    current_stance = 0
-            elif current_stance == -1:
-                if short_close:
-                    current_stance = 0
-
-            stances.append(current_stance)
-
-        self._df['stance'] = stances
-        
-        
-
+        close = self._df['last'].values
+        upper = self._df['upper'].values
+        middle = self._df['middle'].values
+        lower = self._df['lower'].values
+
+        with np.errstate(invalid='ignore'):
+            long_signal = close >= upper
+            short_signal = close < lower
+            long_close = close <= middle
+            short_close = close >= middle
+
+        self._df['stance'] = self._stance_machine(long_signal, short_signal, long_close, short_close)
@@ -4,9 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.finance import candlestick2_ohlc
+from lazy import plt, sns
 import math
 from backtester import Backtester
 import indicators.heikenashi
@@ -36,6 +34,7 @@ class HABacktester(Backtester):
             str(self._long_only),str(self._start_date), str(self._end_date))
 
     def candlestick(self, start_date=None, end_date=None, figsize=None):
+        from matplotlib.finance import candlestick2_ohlc # only in old matplotlib, so only needed here
 
         self._make_sure_has_run()
         temp = self._df.loc[start_date:end_date]
@@ -4,9 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import talib
+from lazy import plt, sns, talib
 from backtester import Backtester
 
 class MABacktester(Backtester):
@@ -43,22 +41,28 @@ class MABacktester(Backtester):
         #plt.show()
         return ax
 
+    def _moving_average(self, window):
+        '''Moving average of the last price, shared with other backtests through the indicator cache'''
+        if self._ema:
+            return self._cached('ema', (window,), lambda: np.round(self._df['last'].ewm(span=window, adjust=False).mean(),8))
+        return self._cached('sma', (window,), lambda: np.round(self._df['last'].rolling(window=window).mean(), 8))
+
+    def _warmup(self):
+        '''A simple MA stance only looks back max(ms, ml) bars, an EMA looks back over all of history'''
+        return None if self._ema else max(self._ms, self._ml)
+
     def _indicators(self):
 
-        if self._ema:
-            self._df['ms'] = np.round(self._df['last'].ewm(span=self._ms, adjust=False).mean(),8)
-            self._df['ml'] = np.round(self._df['last'].ewm(span=self._ml, adjust=False).mean(),8)
-        else:
-            self._df['ms'] = np.round(self._df['last'].rolling(window=self._ms).mean(), 8)
-            self._df['ml'] = np.round(self._df['last'].rolling(window=self._ml).mean(), 8)
+        self._df['ms'] = self._moving_average(self._ms)
+        self._df['ml'] = self._moving_average(self._ml)
 
         self._df['mdiff'] = self._df['ms'] - self._df['ml']
 
         self._df['ml_direction'] = self._df['ml'] - self._df['ml'].shift(1)
 
         # Add bolinger bands
-        self._df['upper'], self._df['middle'], self._df['lower'] = talib.BBANDS(self._df['last'],
-            timeperiod=self._ml, nbdevup=0.5,nbdevdn=0.5)
+        self._df['upper'], self._df['middle'], self._df['lower'] = self._cached('bbands', (self._ml, 0.5, 0.5),
+            lambda: talib.BBANDS(self._df['last'], timeperiod=self._ml, nbdevup=0.5,nbdevdn=0.5))
 
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
@@ -75,3 +79,136 @@ class MABacktester(Backtester):
         # if bollinger inside then remain flat
         #self._df['stance'] = np.where( (self._df['last'] <= self._df['upper']) & (self._df['last'] >= self._df['lower']), 0, self._df['stance'])        
 
+
+
+def ma_sweep(series, ms_range=[1], ml_range=range(5,100), long_only=False, ema=False, slippage=0, chunk_size=None):
+    '''Backtest a grid of MA crossover strategies in one vectorised pass
+
+    Every moving average is calculated once into a shared matrix (a cumulative sum for
+    simple MA's, one ewm per span for EMA's). The stances, strategy returns and stats for
+    every (ms, ml) pair are then worked out as 2D arrays, a chunk of pairs at a time.
+    Gives the same numbers as calling MABacktester(...).results() for each pair.
+
+    Parameters:
+    series: (Panda Series) a list of CLOSE prices by date
+    ms_range: (list) short moving averages to test
+    ml_range: (list) long moving averages to test
+    long_only: (boolean) True if the strategy can only go long
+    ema: (boolean) True if you want exponential MA's
+    slippage: (float) slippage per unit of trade size
+    chunk_size: (int) number of pairs to evaluate at once, if None then sized to roughly 500k cells
+
+    Return:
+    DataFrame with one row per (ms, ml) pair and the same columns as results()
+    '''
+
+    series = series.dropna()
+    last = series.values.astype(np.float64)
+    index = series.index
+    n = len(last)
+
+    pairs = [(ms, ml) for ms in ms_range for ml in ml_range]
+    windows = sorted(set([p[0] for p in pairs] + [p[1] for p in pairs]))
+    row = dict((w, i) for i, w in enumerate(windows))
+
+    # Shared matrix of moving averages, one row per window
+    mas = np.empty((len(windows), n))
+    if ema:
+        for w in windows:
+            mas[row[w]] = series.ewm(span=w, adjust=False).mean().values
+    else:
+        # Centre the prices and accumulate in extended precision so the differences of the
+        # cumulative sum agree with a rolling mean to well within the 8dp rounding below
+        centre = last.mean()
+        cs = np.concatenate(([0], np.cumsum(last - centre, dtype=np.longdouble)))
+        for w in windows:
+            mas[row[w], :w-1] = np.nan
+            mas[row[w], w-1:] = (cs[w:] - cs[:n-w+1]) / w + centre
+    mas = np.round(mas, 8)
+
+    # Market stats are the same for every pair
+    market_ret = np.log(last[1:] / last[:-1])
+    years = (index[-1] - index[0]).days / 365.25
+    days = (index[1] - index[0]).days
+    secs = (index[1] - index[0]).seconds
+    periods_per_year = 365.25 / (days + secs / 3600.0 / 24.0)
+    market = (np.exp(market_ret.sum()) - 1) * 100
+    market_pa = ((market / 100 + 1) ** (1 / years) - 1) * 100
+    market_sharpe = math.sqrt(periods_per_year) * np.average(market_ret) / np.std(market_ret)
+
+    if chunk_size is None:
+        chunk_size = max(1, int(5e5 // n))
+
+    r = []
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start+chunk_size]
+        k = len(chunk)
+
+        with np.errstate(invalid='ignore'):
+            mdiff = mas[[row[p[0]] for p in chunk]] - mas[[row[p[1]] for p in chunk]]
+            is_long = mdiff >= 0
+            is_short = mdiff < 0 if not long_only else np.zeros_like(is_long)
+        del mdiff
+        stance = is_long.view(np.int8) - is_short.view(np.int8)
+
+        moved = stance[:, 1:] != stance[:, :-1]
+        trades = np.count_nonzero(moved, axis=1) + (stance[:, 0] != 0)
+
+        # strategy[t] = market[t] * stance[t-1] - trade_size[t-1] * slippage * |stance[t-1]|
+        # Only the sum and the sum of squares are needed, so build them from dot products
+        # instead of materialising the strategy returns
+        held = stance[:, :-1].astype(np.float64)
+        sum_ret = held.dot(market_ret)
+        sum_sq = np.zeros(k)
+        if slippage:
+            trade_size = np.abs(np.diff(stance[:, :-1], axis=1, prepend=0)).astype(np.float64)
+            cost = trade_size * slippage * np.abs(held)
+            sum_ret -= cost.sum(axis=1)
+            sum_sq += (cost * cost).sum(axis=1) - 2 * (cost * held).dot(market_ret)
+            del trade_size, cost
+        np.abs(held, out=held)
+        sum_sq += held.dot(market_ret * market_ret)
+        del held
+
+        strategy = (np.exp(sum_ret) - 1) * 100
+        strategy_pa = ((strategy / 100 + 1) ** (1 / years) - 1) * 100
+        mean = sum_ret / (n - 1)
+        std = np.sqrt(np.maximum(sum_sq / (n - 1) - mean * mean, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sharpe = math.sqrt(periods_per_year) * mean / std
+
+        # Entry price of the current trade is the price at the start of the final run of stances
+        current_stance = stance[:, -1]
+        last_move = np.argmax(moved[:, ::-1], axis=1)
+        has_moved = moved[np.arange(k), n - 2 - last_move]
+        entry = last[np.where(has_moved, n - 1 - last_move, 0)]
+        unrealised = np.where(current_stance == 1, (last[-1] / entry - 1) * 100,
+                     np.where(current_stance == -1, (entry / last[-1] - 1) * 100, 0))
+
+        flat = n - np.count_nonzero(stance, axis=1)
+        time_in_market = 1 - flat / float(n) # as results() does, the sum of long and short can round differently
+        time_long = np.count_nonzero(is_long, axis=1) / float(n)
+        time_short = np.count_nonzero(is_short, axis=1) / float(n)
+
+        r.append(np.column_stack((strategy, trades, sharpe, strategy_pa, current_stance, unrealised,
+                                  time_in_market, time_long, time_short)))
+
+    r = np.concatenate(r)
+    df = pd.DataFrame(pairs, columns=['ms', 'ml'])
+    df['Strategy'] = np.round(r[:, 0], 2)
+    df['Market'] = np.round(market, 2)
+    df['Trades'] = r[:, 1].astype(int)
+    df['Sharpe'] = np.round(r[:, 2], 2)
+    df['Strategy_pa'] = np.round(r[:, 3], 2)
+    df['Market_pa'] = np.round(market_pa, 2)
+    df['Years'] = np.round(years, 2)
+    df['Trades_per_month'] = np.round(r[:, 1] / years / 12, 2)
+    df['Market_sharpe'] = np.round(market_sharpe, 2)
+    df['Current_stance'] = r[:, 4].astype(int)
+    df['Unrealised'] = np.round(r[:, 5], 2)
+    df['Time_in_market'] = np.round(r[:, 6] * 100, 2)
+    df['Time_long'] = np.round(r[:, 7] * 100, 2)
+    df['Time_short'] = np.round(r[:, 8] * 100, 2)
+    df['Start_date'] = index[0].strftime('%Y-%m-%d')
+    df['End_date'] = index[-1].strftime('%Y-%m-%d')
+    return df
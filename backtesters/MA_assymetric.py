@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from backtester import Backtester
 
 class MAAssymetricBacktester(Backtester):
@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from MA import MABacktester
 
 class MADelayBacktester(MABacktester):
@@ -29,6 +28,11 @@ class MADelayBacktester(MABacktester):
             self._ms, self._ml, str(self._ema), str(self._long_only), str(self._start_date), str(self._end_date))
 
 
+    def _warmup(self):
+        '''One bar more than the MA crossover since yesterday's crossover is used too'''
+        warmup = super(MADelayBacktester,self)._warmup()
+        return None if warmup is None else warmup + 1
+
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
         a set of stances
@@ -5,14 +5,9 @@ and uses that until a better MA pair is found
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from ipywidgets import IntProgress
-from IPython.display import display
+from lazy import plt, sns, set_trace
 from backtester import Backtester
-from MA import MABacktester
 
-from IPython.core.debugger import set_trace
 
 class MALiveOptimiseBacktester(Backtester):
     '''Backtest a strategy that keeps choosing the best MA pair from the past x days
@@ -45,21 +40,49 @@ class MALiveOptimiseBacktester(Backtester):
         for ma in ma_list:
             self._df[str(ma)] = self._df['last'].rolling(window=ma).mean()
 
-    def _find_best_strat(self, data):
-        
+    def _best_strats(self):
+        '''For every bar work out which strategy had the best return over the previous
+        lookback bars, the same as running an MABacktester on each slice
+
+        Each candidate's stance comes from the MA columns built by _indicators(). Within a
+        slice the MA's need max(ms, ml) - 1 bars to warm up, so the slice return is a rolling
+        sum of stance * next return over the remaining bars, kept as a cumulative sum so each
+        bar is an O(1) update.
+
+        Return:
+        numpy array with the index of the best strategy for each bar
+        '''
+
+        n = len(self._df)
+        best = np.zeros(n, dtype=int) # use the first strategy until there is enough history
+
         # is there only 1 strategy?
-        if len(self._strats) == 1:
-            return self._strats[0]
+        if len(self._strats) == 1 or n <= self._lookback:
+            return best
 
-        best_ret = -100
-        best_strat = None
-        
-        for strat in self._strats:
-            ret = MABacktester(data,strat[0],strat[1]).results()['Strategy']
-            if ret > best_ret:
-                best_ret = ret
-                best_strat = strat
-        return best_strat
+        last = self._df['last'].values
+        market = np.log(last[1:] / last[:-1])
+        bars = np.arange(self._lookback, n)
+        best_ret = np.full(len(bars), -100.0)
+
+        for k, (ms, ml) in enumerate(self._strats):
+            mdiff = np.round(self._df[str(ms)].values, 8) - np.round(self._df[str(ml)].values, 8)
+            with np.errstate(invalid='ignore'):
+                stance = np.where(mdiff >= 0, 1, np.where(mdiff < 0, -1, 0))
+
+            # strategy return earned from bar u to bar u+1, cum_ret[u] is the total before bar u
+            cum_ret = np.concatenate(([0], np.cumsum(stance[:-1] * market)))
+
+            # slice for bar i is i-lookback to i-1, the first bar with a stance is i-lookback+warmup
+            warmup = max(ms, ml) - 1
+            first = np.minimum(bars - self._lookback + warmup, bars - 1)
+            ret = np.round((np.exp(cum_ret[bars - 1] - cum_ret[first]) - 1) * 100, 2)
+
+            better = ret > best_ret
+            best_ret[better] = ret[better]
+            best[bars[better]] = k
+
+        return best
 
 
     def _trade_logic(self):
@@ -67,62 +90,21 @@ class MALiveOptimiseBacktester(Backtester):
         a set of stances
         '''
 
-        max_count = len(self._df)
-        bar = IntProgress(min=0, max=max_count) # instantiate a progress bar
-        display(bar) # display the bar
-
         self._indicators()
 
-        current_stance = 0
-        stances = []
-        
-        i = 0
-
-        for date, row in self._df.iterrows():
-            
-            if i>=self._lookback:
-                strat = self._find_best_strat(self._df['last'].iloc[i-self._lookback:i])
-            else:
-                strat = self._strats[0]
-
-           
-            buy_signal = False
-            sell_signal = False
-            
-            ms = str(strat[0])
-            ml = str(strat[1])
-
-            if row[ms] >= row[ml]:
-                buy_signal = True
-            else:
-                sell_signal = True
-
-            # If the ma values are not avail yet then stay neutral
-            if np.isnan(row[ml]):
-                buy_signal = False
-                sell_signal = False
-
-            if current_stance == 0:
-                if buy_signal:
-                    current_stance = 1
-                    
-                if sell_signal:
-                    current_stance = -1
-                    
-
-            elif current_stance == 1:
-                if sell_signal:
-                    current_stance = -1
-                    
-                    
-            else: # you are -1
-                if buy_signal:
-                    current_stance = 1
-                    
-
-            stances.append(current_stance)
-            i+=1
-            bar.value += 1
-
-        self._df['stance'] = stances
-        
+        best = self._best_strats()
+
+        a,b = zip(*self._strats)
+        windows = sorted(set(a+b))
+        mas = self._df[[str(w) for w in windows]].values
+        column = dict((w, i) for i, w in enumerate(windows))
+        ms = mas[np.arange(len(best)), [column[self._strats[k][0]] for k in best]]
+        ml = mas[np.arange(len(best)), [column[self._strats[k][1]] for k in best]]
+
+        # Long if ms >= ml, otherwise short. If the ml value is not avail yet then keep
+        # the previous stance, which is neutral at the start
+        with np.errstate(invalid='ignore'):
+            signal = pd.Series(np.where(ms >= ml, 1.0, -1.0))
+        signal[np.isnan(ml)] = np.nan
+
+        self._df['stance'] = signal.fillna(method='ffill').fillna(0).astype(int).values
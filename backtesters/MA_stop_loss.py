@@ -2,12 +2,12 @@
 '''
 
 import math
+from bisect import bisect_left
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, set_trace
 from MA import MABacktester
-from IPython.core.debugger import set_trace
+from timeframes import periods, first_of_period, to_bars
 
 class MAStopLossBacktester(MABacktester):
     '''Backtest a Moving Average (MA) crossover strategy with stop loss for shorts only
@@ -67,8 +67,9 @@ class MAStopLossBacktester(MABacktester):
         if not self._EOD_only or self._freq=="D":
             return super(MAStopLossBacktester,self)._indicators()
 
-        # if EOD_only then calculate indicators using EOD data only
-        daily = self._df['last'].resample("D").first().to_frame()
+        # if EOD_only then calculate indicators using EOD data only, the first price of each day
+        position, first, _ = periods(self._df, 'D')
+        daily = pd.DataFrame({'last': first_of_period(self._df.array('last'), first)})
 
         if self._ema:
             daily['ms'] = np.round(daily['last'].ewm(span=self._ms, adjust=False).mean(),8)
@@ -80,14 +81,13 @@ class MAStopLossBacktester(MABacktester):
         daily['mdiff'] = daily['ms'] - daily['ml']
         daily['ml_direction'] = daily['ml'] - daily['ml'].shift(1)
 
+        # every bar of the day gets that day's values
+        for name in ('ms', 'ml', 'mdiff', 'ml_direction'):
+            self._df[name] = to_bars(daily[name].values, position)
 
-        hourly = daily[['ms','ml','mdiff','ml_direction']].resample(self._freq).first().fillna(method='ffill')
-
-        self._df['ms'] = hourly['ms']
-        self._df['ml'] = hourly['ml']
-        self._df['mdiff'] = hourly['mdiff']
-
-        self._df['ml_direction'] = hourly['ml_direction']
+    def _warmup(self):
+        '''The stops carry on from one bar to the next, append() reruns the whole history'''
+        return None
 
     def _market_returns(self):
         
@@ -97,99 +97,199 @@ class MAStopLossBacktester(MABacktester):
         self._df['buy'] = np.where( self._df['stance'] - self._df['stance'].shift(1).fillna(0) > 0, self._df['last_adj_stops'], np.NAN)
         self._df['sell'] = np.where( self._df['stance'] - self._df['stance'].shift(1).fillna(0) < 0, self._df['last_adj_stops'], np.NAN)
 
-    def _trade_logic(self):
-        '''Implements the trade logic in order to come up with
-        a set of stances
+    def stop_events(self):
+        '''Return a Pandas DataFrame with details of each stop loss that was hit
+        '''
+        self._make_sure_has_run()
+        df = pd.DataFrame(self._stop_events).set_index('time')
+        if self._df.index.tz is not None:
+            df.index = df.index.tz_localize('UTC').tz_convert(self._df.index.tz)
+        return df
+
+    def _stop_machine(self, last, high, low, buy, sell, long_stops=True, short_stop_stance=0):
+        '''Work out stances and stop losses from arrays of prices and signals
+
+        Signals are acted on at the close. A stop is checked against the high (shorts) or
+        low (longs) of each bar before any signal on that bar. If a short gets stopped out
+        then wait for the next buy before shorting again, and if a long gets stopped out
+        wait for the next sell before going long again.
+
+        Only bars where a signal can change the position get stepped through one at a time.
+        In between, the stop levels (including trailing stops) are scanned as arrays to find
+        the first bar where a stop is hit.
+
+        Parameters:
+        last: (numpy array) CLOSE prices
+        high: (numpy array) HIGH prices
+        low: (numpy array) LOW prices
+        buy: (numpy array) boolean flags for a buy signal at the close
+        sell: (numpy array) boolean flags for a sell signal at the close
+        long_stops: (boolean) True if longs have a stop loss as well as shorts
+        short_stop_stance: (int) stance after a short is stopped out, 1 if holding physical
+
+        Return:
+        Tuple of the stances, the stop prices hit (NaN where no stop) and a record array of
+        stop events with fields time, side, entry, exit and loss
         '''
 
-        self._indicators()
-
-        # If I hit a stop loss can I go long the same day? Yes in fact check for go long first in which case stop not needed
-        # If a short gets stopped out then wait for next buy before any more shorts
+        n = len(last)
+        buys = np.flatnonzero(buy).tolist()
+        sells = np.flatnonzero(sell).tolist()
+        stops = np.full(n, np.nan)
+        events = []
+        changes = [] # (bar, new stance)
 
         current_stance = 0
-        stances = []
         entry_price = None
-        current_price = None
         stop_loss = None
-        
-        # list of stops to be used for chart
-        stops = self._df['last'].copy()
-        stops[:] = np.nan 
-        
-        wait_for_long = False
-        #stop_loss = self._stop_loss
-
-        for index, row in self._df.iterrows():
-            
-            # Handle intraday data and also support EOD only trades
-            
-            if index.hour == 0:
-                end_of_day = True
-            else:
-                end_of_day = False
-
-            current_price = row['last']
-            current_high = row['high']
-            current_low = row['low']
-            ml_direction = row['ml_direction']
-            
-            buy_signal = False
-            sell_signal = False
-            
+        stop_price = None
+        wait_for_long = wait_for_short = False
+        i = 0 # next bar to process
+
+        while i < n:
+
+            # Next bar where a signal could change the position
+            k = n
+            if current_stance == 0:
+                if not wait_for_short:
+                    k = min(k, self._next_bar(buys, i, n))
+                if not wait_for_long:
+                    k = min(k, self._next_bar(sells, i, n))
+            elif current_stance == 1:
+                k = self._next_bar(buys if wait_for_long else sells, i, n)
+            elif not wait_for_short:
+                k = self._next_bar(buys, i, n)
+
+            # Scan the stop levels up to and including that bar for the first one hit
+            if current_stance == -1 or (current_stance == 1 and long_stops and entry_price is not None):
+                end = min(k, n - 1)
+                if current_stance == -1:
+                    moved = low[i:end+1] < entry_price
+                    levels = low[i:end+1] + stop_loss
+                else:
+                    moved = high[i:end+1] > entry_price
+                    levels = high[i:end+1] - stop_loss
+
+                if self._trailing_stop:
+                    # carry forward the level from the last bar that moved the stop
+                    last_move = np.maximum.accumulate(np.where(moved, np.arange(1, len(levels) + 1), 0))
+                    levels = np.concatenate(([stop_price], levels))[last_move]
+                else:
+                    levels = np.full(len(moved), stop_price)
+
+                with np.errstate(invalid='ignore'):
+                    hit = high[i:end+1] >= levels if current_stance == -1 else low[i:end+1] <= levels
+                if hit.any():
+                    k = i + np.argmax(hit)
+                # level at the end of the bar before k, bar k updates it again below
+                if k > i:
+                    stop_price = levels[min(k, n) - i - 1]
+
+            if k >= n:
+                break
+
+            previous_stance = current_stance
+            current_price, current_high, current_low = last[k], high[k], low[k]
+
             # Check for stop loss
 
-            if current_stance == -1: 
+            if current_stance == -1:
 
                 if self._trailing_stop:
                     if current_low < entry_price:
                         stop_price = current_low + stop_loss
 
-                if current_high >= stop_price: 
-                    current_stance = 1 # if short is stopped then you are now long since you are holding physical
-                    stops.loc[index] = current_high
-                    print "Stop loss for short triggered at %s entry %0.5f exit %0.5f loss %0.1f%%" % (str(index),
-                        entry_price, current_high, (entry_price/current_high-1) * 100)
+                if current_high >= stop_price:
+                    current_stance = short_stop_stance
+                    stops[k] = current_high
+                    events.append((k, 'Short', entry_price, current_high, (entry_price/current_high-1) * 100))
                     entry_price = None
                     wait_for_long = True # If a short gets stopped out then wait for next long before shorting again
-            
-            if end_of_day or not self._EOD_only:
-
-                if row['mdiff'] >= 0:
-                    buy_signal = True
-                if row['mdiff'] < 0:
-                    sell_signal = True
-
-                if current_stance == 0:
-                    if buy_signal:
-                        current_stance = 1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price - stop_loss
-                        wait_for_long = False
-                    if sell_signal and not wait_for_long:
-                        current_stance = -1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price + stop_loss
-                        #print "Going short on %s at %0.1f" % (str(index),entry_price)
-                elif current_stance == 1 and not wait_for_long:
-                    if sell_signal:
-                        current_stance = -1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price + stop_loss
-                        #print "Going short on %s at %0.1f" % (str(index),entry_price)
-                else: # you are -1
-                    if buy_signal:
-                        current_stance = 1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price - stop_loss
-                        wait_for_long = False
-
-            
-            stances.append(current_stance)
+
+            elif current_stance == 1 and long_stops:
+
+                if self._trailing_stop:
+                    if current_high > entry_price:
+                        stop_price = current_high - stop_loss
+
+                if current_low <= stop_price:
+                    current_stance = 0
+                    stops[k] = current_low
+                    events.append((k, 'Long', entry_price, current_low, (current_low/entry_price-1) * 100))
+                    entry_price = None
+                    wait_for_short = True # If a long gets stopped out then wait for next short before going long again
+
+            buy_signal, sell_signal = buy[k], sell[k]
+
+            if current_stance == 0:
+                if buy_signal and not wait_for_short:
+                    current_stance = 1
+                    entry_price = current_price
+                    stop_loss = self._stop_loss * entry_price
+                    stop_price = current_price - stop_loss
+                    wait_for_long = False
+                if sell_signal and not wait_for_long:
+                    current_stance = -1
+                    entry_price = current_price
+                    stop_loss = self._stop_loss * entry_price
+                    stop_price = current_price + stop_loss
+                    wait_for_short = False
+            elif current_stance == 1 and not wait_for_long:
+                if sell_signal:
+                    wait_for_short = False
+                    current_stance = -1
+                    entry_price = current_price
+                    stop_loss = self._stop_loss * entry_price
+                    stop_price = current_price + stop_loss
+            else: # you are -1, or long after a short was stopped
+                if buy_signal and not wait_for_short:
+                    current_stance = 1
+                    entry_price = current_price
+                    stop_loss = self._stop_loss * entry_price
+                    stop_price = current_price - stop_loss
+                    wait_for_long = False
+
+            if current_stance != previous_stance:
+                changes.append((k, current_stance))
+            i = k + 1
+
+        bars = [0] + [c[0] for c in changes] + [n]
+        stances = np.repeat([0] + [c[1] for c in changes], np.diff(bars))
+
+        events = np.array([(self._df.index.values[e[0]],) + e[1:] for e in events],
+                          dtype=[('time', 'M8[ns]'), ('side', 'U5'), ('entry', 'f8'), ('exit', 'f8'), ('loss', 'f8')])
+
+        return stances, stops, events.view(np.recarray)
+
+    def _next_bar(self, bars, i, n):
+        '''First bar in the sorted list bars that is i or later, n if there is none'''
+        j = bisect_left(bars, i)
+        return bars[j] if j < len(bars) else n
+
+    def _signals(self):
+        '''Buy and sell flags at the close, on the last bar of the day only if EOD_only'''
+
+        # Handle intraday data and also support EOD only trades, the bar opening each day is the close of the day before
+        trade_bar = periods(self._df, 'D')[2] if self._EOD_only else True
+
+        mdiff = self._df['mdiff'].values
+        with np.errstate(invalid='ignore'):
+            return trade_bar & (mdiff >= 0), trade_bar & (mdiff < 0)
+
+    def _trade_logic(self):
+        '''Implements the trade logic in order to come up with
+        a set of stances
+        '''
+
+        self._indicators()
+
+        # If I hit a stop loss can I go long the same day? Yes in fact check for go long first in which case stop not needed
+        # If a short gets stopped out then wait for next buy before any more shorts
+        # A short that is stopped out leaves you long since you are holding physical
+
+        buy, sell = self._signals()
+        stances, stops, self._stop_events = self._stop_machine(self._df['last'].values, self._df['high'].values,
+            self._df['low'].values, buy, sell, long_stops=False, short_stop_stance=1)
 
         self._df['stance'] = stances
         self._df['stop'] = stops
@@ -4,10 +4,8 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, set_trace
 from MA_stop_loss import MAStopLossBacktester
-from IPython.core.debugger import set_trace
 
 class MAStopLossBacktester2(MAStopLossBacktester):
     '''Backtest a Moving Average (MA) crossover strategy with stop loss for BOTH the shorts and the long sides
@@ -62,110 +60,11 @@ class MAStopLossBacktester2(MAStopLossBacktester):
         # If I hit a stop loss can I go long the same day? Yes in fact check for go long first in which case stop not needed
         # If a short gets stopped out then wait for next buy before any more shorts
 
-        current_stance = 0
-        stances = []
-        entry_price = None
-        current_price = None
-        stop_loss = None
-        
-        # list of stops to be used for chart
-        stop_short = stop_long = self._df['last'].copy()
-        stop_short[:] = stop_long[:] = np.nan 
-        
-        wait_for_long = wait_for_short = False
-        #stop_loss = self._stop_loss
-
-        for index, row in self._df.iterrows():
-            
-            # Handle intraday data and also support EOD only trades
-
-            if index.hour == 0:
-                end_of_day = True
-            else:
-                end_of_day = False
-
-            current_price = row['last']
-            current_high = row['high']
-            current_low = row['low']
-            
-            buy_signal = False
-            sell_signal = False
-            
-
-            # Check for stop loss
-
-            if current_stance == -1: 
-
-                if self._trailing_stop:
-                    if current_low < entry_price:
-                        stop_price = current_low + stop_loss
-
-                if current_high >= stop_price: 
-                    current_stance = 0 # if short is stopped then you are flat
-                    stop_short.loc[index] = current_high
-                    print "Stop loss for short triggered at %s entry %0.5f exit %0.5f loss %0.1f%%" % (str(index),
-                        entry_price, current_high, (entry_price/current_high-1) * 100)
-                    entry_price = None
-                    wait_for_long = True # If a short gets stopped out then wait for next long before shorting again
-            
-            elif current_stance == 1: 
-
-                if self._trailing_stop:
-                    if current_high > entry_price:
-                        stop_price = current_high - stop_loss
-
-                if current_low <= stop_price: 
-                    current_stance = 0 # if short is stopped then you are now flat
-                    stop_long.loc[index] = current_low
-                    print "Stop loss for long triggered at %s entry %0.5f exit %0.5f loss %0.1f%%" % (str(index),
-                        entry_price, current_low, (current_low/entry_price-1) * 100)
-                    entry_price = None
-                    wait_for_short = True # If a long gets stopped out then wait for next short before going long again
-
-            if end_of_day or not self._EOD_only:
-
-                if row['mdiff'] >= 0:
-                    buy_signal = True
-                if row['mdiff'] < 0 :
-                    sell_signal = True
-
-                if current_stance == 0:
-                    if buy_signal and not wait_for_short:
-                        current_stance = 1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price - stop_loss
-                        wait_for_long = False
-                    if sell_signal and not wait_for_long:
-                        current_stance = -1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price + stop_loss
-                        wait_for_short = False
-                        #print "Going short on %s at %0.1f" % (str(index),entry_price)
-                elif current_stance == 1 and not wait_for_long:
-                    if sell_signal:
-                        wait_for_short = False
-                        current_stance = -1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price + stop_loss
-                        #print "Going short on %s at %0.1f" % (str(index),entry_price)
-                else: # you are -1
-                    if buy_signal and not wait_for_short:
-                        current_stance = 1
-                        entry_price = current_price
-                        stop_loss = self._stop_loss * entry_price
-                        stop_price = current_price - stop_loss
-                        wait_for_long = False
-
-            
-            stances.append(current_stance)
+        buy, sell = self._signals()
+        stances, stops, self._stop_events = self._stop_machine(self._df['last'].values, self._df['high'].values,
+            self._df['low'].values, buy, sell, long_stops=True, short_stop_stance=0)
 
         self._df['stance'] = stances
-        self._df['stop_short'] = stop_short
-        self._df['stop_long'] = stop_long
-
-
-
-
+        # both columns have always held the stops for both sides, the side is in stop_events()
+        self._df['stop_short'] = stops
+        self._df['stop_long'] = stops
@@ -1,83 +1,92 @@
-import backtester
-reload(backtester)
-import MA
-reload(MA)
-from MA import MABacktester
-import pantera
-reload(pantera)
-from pantera import PanteraBacktester
-import RSI
-reload(RSI)
-from RSI import RSIBacktester
-import MACD
-reload(MACD)
-from MACD import MACDBacktester
-import portfolio
-reload(portfolio)
-from portfolio import PortfolioBacktester
-import buyifup
-reload(buyifup)
-from buyifup import BuyIfUpBacktester
-import newhigh
-reload(newhigh)
-from newhigh import NewHighBacktester
-import stochastic
-reload(stochastic)
-from stochastic import StochasticBacktester
-import sar
-reload(sar)
-from sar import SARBacktester
-import MA_stop_loss
-reload(MA_stop_loss)
-from MA_stop_loss import MAStopLossBacktester
-import williams
-reload(williams)
-from williams import WilliamsRBacktester
-import MA_short_only
-reload(MA_short_only)
-from MA_short_only import MAShortOnlyBacktester
-import yale
-reload(yale)
-from yale import YaleBacktester
-import MA_delay
-reload(MA_delay)
-from MA_delay import MADelayBacktester
-import majority_signal
-reload(majority_signal)
-from majority_signal import MajoritySignalBacktester
-import donchian
-reload(donchian)
-from donchian import DonchianBacktester
-import triple_MA
-reload(triple_MA)
-from triple_MA import TripleMABacktester
-import bollinger_MR
-reload(bollinger_MR)
-from bollinger_MR import BollingerMR
-import bollinger_momentum
-reload(bollinger_momentum)
-from bollinger_momentum import BollingerMomentum
-import ATR
-reload(ATR)
-from ATR import ATRMomentum
-import google
-reload(google)
-from google import GoogleBacktester
-import MA_assymetric
-reload(MA_assymetric)
-from MA_assymetric import MAAssymetricBacktester
-import MA_stop_loss2
-reload(MA_stop_loss2)
-from MA_stop_loss2 import MAStopLossBacktester2
-import HA
-reload(HA)
-from HA import HABacktester
-import vwap
-reload(vwap)
-from vwap import VWAPBacktester
-import higher
-reload(higher)
-from higher import HigherPriceBacktester
-import MA_live_optimise
-reload(MA_live_optimise)
-from MA_live_optimise import MALiveOptimiseBacktester
\ No newline at end of file
+'''Backtesters for trading strategies
+
+Nothing is imported up front. Each name below is imported from its module the first time it is
+used, so importing the package is quick and a batch worker only loads the strategies it runs.
+Plotting libraries are only loaded by the plot methods (see lazy.py).
+
+Reloading the package (reload(backtesters) in a notebook) reloads every strategy module that had
+been loaded, in the same order as before, the next time a name is used.
+'''
+
+import os
+import sys
+import importlib
+
+try:
+    from importlib import reload as _reload
+except ImportError:
+    _reload = reload
+
+# The modules import each other by plain name, e.g. from backtester import Backtester
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.append(_here)
+
+# name -> module, in the order the modules were always imported
+_NAMES = [
+    ('IndicatorCache', 'indicator_cache'),
+    ('shared_cache', 'indicator_cache'),
+    ('MABacktester', 'MA'),
+    ('ma_sweep', 'MA'),
+    ('PanteraBacktester', 'pantera'),
+    ('RSIBacktester', 'RSI'),
+    ('MACDBacktester', 'MACD'),
+    ('PortfolioBacktester', 'portfolio'),
+    ('BuyIfUpBacktester', 'buyifup'),
+    ('NewHighBacktester', 'newhigh'),
+    ('StochasticBacktester', 'stochastic'),
+    ('SARBacktester', 'sar'),
+    ('MAStopLossBacktester', 'MA_stop_loss'),
+    ('WilliamsRBacktester', 'williams'),
+    ('MAShortOnlyBacktester', 'MA_short_only'),
+    ('YaleBacktester', 'yale'),
+    ('MADelayBacktester', 'MA_delay'),
+    ('MajoritySignalBacktester', 'majority_signal'),
+    ('DonchianBacktester', 'donchian'),
+    ('TripleMABacktester', 'triple_MA'),
+    ('BollingerMR', 'bollinger_MR'),
+    ('BollingerMomentum', 'bollinger_momentum'),
+    ('ATRMomentum', 'ATR'),
+    ('GoogleBacktester', 'google'),
+    ('MAAssymetricBacktester', 'MA_assymetric'),
+    ('MAStopLossBacktester2', 'MA_stop_loss2'),
+    ('HABacktester', 'HA'),
+    ('VWAPBacktester', 'vwap'),
+    ('HigherPriceBacktester', 'higher'),
+    ('MALiveOptimiseBacktester', 'MA_live_optimise'),
+    ('run_batch', 'batch'),
+    ('WalkForwardBacktester', 'walk_forward'),
+]
+_MODULES = ['backtester'] + [m for i, (_, m) in enumerate(_NAMES) if m not in [n[1] for n in _NAMES[:i]]]
+_OWNER = dict(_NAMES)
+
+__all__ = _MODULES + [name for name, _ in _NAMES]
+
+# modules already loaded when the package is (re)loaded are reloaded before anything is handed out
+_stale = [m for m in _MODULES if m in sys.modules]
+for _name in __all__:
+    globals().pop(_name, None) # a reload keeps the old names, drop them so they are looked up again
+
+
+def _load(module):
+    global _stale
+    if _stale:
+        stale, _stale = _stale, []
+        for m in stale:
+            _reload(sys.modules[m])
+    return importlib.import_module(module)
+
+
+def __getattr__(name):
+    if name in _OWNER:
+        value = getattr(_load(_OWNER[name]), name)
+    elif name in _MODULES:
+        value = _load(name)
+    else:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    globals()[name] = value # found directly from now on
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
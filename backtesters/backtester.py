@@ -1,12 +1,16 @@
 '''Abstract class for backtesting strategies. Takes a vectorised approach using Pandas and Numpy.
+Series are kept as numpy arrays in a column store and only turned into a DataFrame when needed.
 '''
 
 import math
+import copy
+import time
+from bisect import bisect_left
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from IPython.core.debugger import set_trace
+from lazy import plt, sns, set_trace
+from columns import Columns
+from indicator_cache import shared_cache
 
 class Backtester(object):
     '''Abstract base class
@@ -16,27 +20,153 @@ class Backtester(object):
     long_only: (boolean) True if the strategy can only go long
     '''
 
+    _profiler = None # set by set_profiling()
+
     def __init__(self, series, long_only=False, slippage=0):
-        self._df = series.to_frame().dropna()
-        self._df.columns = ['last']
+        if series.hasnans:
+            series = series.dropna()
+        self._df = Columns(series.index) # a clean series is used in place, not copied
+        self._df['last'] = series.values
         self._long_only = long_only
         self._results = {}
         self._has_run = False
         self._trades = []
+        self._drawdowns = {}
+        self._drawdown_highs = {}
         self._start_date = self._df.index[0].strftime('%Y-%m-%d')
         self._end_date = self._df.index[-1].strftime('%Y-%m-%d')
         self._slippage = slippage
 
     def change_data(self, series):
         '''Allow the price data to be changed after the strategy is initialised'''
-        self._df = series.to_frame().dropna()
-        self._df.columns = ['last']
+        if series.hasnans:
+            series = series.dropna()
+        self._df = Columns(series.index)
+        self._df['last'] = series.values
         self._results = {}
         self._has_run = False
         self._trades = []
+        self._drawdowns = {}
+        self._drawdown_highs = {}
         self._start_date = self._df.index[0].strftime('%Y-%m-%d')
         self._end_date = self._df.index[-1].strftime('%Y-%m-%d')
 
+    def append(self, bars):
+        '''Add new bars to the end of the data and bring the backtest up to date
+
+        Only the new rows are worked out. A strategy whose stance depends on a fixed number of
+        past bars (see _warmup) reruns its trade logic on just those bars and the new ones, others
+        rerun it over the whole history. Returns and the running totals behind results() are
+        carried forward from where they were, drawdowns() picks up from the last high. If the
+        rerun changes the stance of an earlier bar (a hold that now runs on) they are all worked
+        out again.
+
+        Parameters:
+        bars: (Panda Series) new CLOSE prices by date, or a DataFrame with a column for each
+            series the strategy was given, e.g. last, high, low, volume. A ValueError is raised
+            if any of them are missing
+        '''
+
+        if isinstance(bars, pd.Series):
+            bars = bars.to_frame('last')
+        missing = np.isnan(bars['last'].values)
+        if missing.any():
+            bars = bars[~missing]
+        if len(bars) == 0:
+            return
+        if bars.index[0] <= self._df.index[-1]:
+            raise ValueError('New bars must come after the last bar')
+        missing = [c for c in (self._inputs if self._has_run else self._df) if c not in bars.columns]
+        if missing:
+            raise ValueError('New bars are missing %s' % ', '.join(missing))
+
+        start = len(self._df)
+        self._df.append(bars.index, dict((c, bars[c].values) for c in bars.columns if c in self._df))
+        self._end_date = bars.index[-1].strftime('%Y-%m-%d')
+        self._trades = []
+        if not self._has_run:
+            return
+
+        warmup = self._warmup()
+        if warmup is None:
+            before = dict((name, self._df.array(name)[:start].copy()) for name in ('stance', 'market'))
+            self._trade_logic()
+            self._market_returns()
+            if not all(np.array_equal(before[name], self._df.array(name)[:start], equal_nan=True) for name in before):
+                # the new bars changed earlier stances, e.g. a hold that now runs on, so start the totals again
+                self._trades = []
+                self._drawdowns.pop('strategy', None)
+                self._drawdown_highs.pop('strategy', None)
+                self._returns()
+                return
+        else:
+            self._tail_logic(max(0, start - warmup - 1), start) # one more bar for the change in stance
+        self._extend_returns(start) # drawdowns() catches up its tables when next asked
+
+        strategy_stats = _mean_std(self._totals['strategy_moments'])
+        market_stats = _mean_std(self._totals['market_moments'])
+        self._results = self._summary(self._totals['strategy'], self._totals['market'], strategy_stats, market_stats)
+
+    def _warmup(self):
+        '''Number of bars before a bar that its stance depends on, None if it depends on all of history
+        (exponential averages, stances that carry on from the last one). Used by append()
+        '''
+        return None
+
+    def _tail_logic(self, first, start):
+        '''Rerun the trade logic on a copy of the bars from first and keep the rows from start'''
+        tail = copy.copy(self)
+        tail._df = self._df.take(first)
+        if self._profiler is not None:
+            tail._instrument(self._profiler) # the copied timers would run this backtester's methods
+        tail._trade_logic()
+        tail._market_returns()
+        for name in tail._df:
+            self._df.write(name, start, tail._df.array(name)[start - first:])
+
+    def _extend_returns(self, start):
+        '''Work out the trades and returns of the rows from start, the same way as _run()'''
+        stance = self._df.array('stance')
+        prev_stance = stance[start - 1:-1].astype(np.float64)
+        prev_stance0 = _fill(prev_stance, 0)
+        trade_size = np.abs(stance[start:] - prev_stance0)
+        prev_trade_size = np.concatenate((self._df.array('trade_size')[start - 1:start], trade_size[:-1]))
+
+        self._df.write('trade', start, np.where(stance[start:] != prev_stance0, 1, 0))
+        self._df.write('trade_size', start, trade_size)
+        self._df.write('market_adj', start, self._df.array('market')[start:] - (prev_trade_size * self._slippage * prev_stance))
+        strategy = self._df.array('market_adj')[start:] * prev_stance
+        self._df.write('strategy', start, strategy)
+        # carry on the cumulative log return from the last bar
+        self._df.write('strategy_last', start, np.exp(_cumsum(np.concatenate(([self._totals['strategy']], strategy)))[1:]))
+        self._add_totals(start)
+
+    def _extend_drawdowns(self, target):
+        '''Bring a cached drawdown table up to date after append()
+
+        Episodes that ended before the last high can not change, so only the bars from the
+        last high onwards are looked at again
+        '''
+        high, end = self._drawdown_highs[target]
+        if end == len(self._df):
+            return
+        table = self._drawdowns[target]
+        series = self._drawdown_series(target, self._df.index.searchsorted(high))
+        # both parts are already sorted and the old episodes all come first in time
+        table = pd.concat([table[table['highd'] < high], self._drawdown_episodes(series)])
+        table = table.iloc[np.argsort(-table['dd'].values, kind='mergesort')]
+        self._drawdowns[target] = table.reset_index(drop=True)
+        self._drawdown_highs[target] = (_last_high(series), len(self._df))
+
+    @property
+    def _df(self):
+        '''Column store holding every series of the backtest (see Columns)'''
+        return self._columns
+
+    @_df.setter
+    def _df(self, df):
+        self._columns = df if isinstance(df, Columns) else Columns.from_frame(df)
+
     def __str__(self):
         '''Each concreate class will have its own string representation
         '''
@@ -50,6 +180,40 @@ class Backtester(object):
         self._make_sure_has_run()
         return self._results
 
+    def set_profiling(self, enabled=True):
+        '''Time each phase of the backtest from now on, see profile()
+
+        The timers are wrappers put on this backtester only, when profiling is off nothing
+        is timed and the methods run as normal. Turning it on again starts new timers.
+        '''
+        self._use_profiler(_Profiler() if enabled else None)
+
+    def profile(self):
+        '''Seconds spent in each phase since set_profiling(), the bars the trade logic went
+        through and the bars per second over all the phases. Time spent in a phase that runs
+        inside another (a strategy run by a portfolio's trade logic) only counts once.
+
+        Return:
+        dict like results(), empty if profiling is off
+        '''
+        if self._profiler is None:
+            return {}
+        return self._profiler.summary()
+
+    def _use_profiler(self, profiler):
+        '''Time this backtester into profiler, None to stop timing it'''
+        for name in _PROFILED:
+            self.__dict__.pop(name, None)
+        self._profiler = profiler
+        if profiler is not None:
+            self._instrument(profiler)
+
+    def _instrument(self, profiler):
+        '''Put a timer on each profiled method of this backtester'''
+        for name, phase in _PROFILED.items():
+            bars = (lambda: len(self._df)) if name == '_trade_logic' else None
+            setattr(self, name, profiler.timed(phase, getattr(type(self), name).__get__(self), bars))
+
 
     def _sum_returns(self, returns, groupby):
         '''
@@ -63,7 +227,95 @@ class Backtester(object):
 
     def _cross_under (self, a, b):
         '''Returns true where series a crosses over series b'''
-        return ( (a < b) & (a.shift(1) > b.shift(1) ) ) 
+        return ( (a < b) & (a.shift(1) > b.shift(1) ) )
+
+    def _cached(self, name, params, compute, columns=('last',)):
+        '''Get an indicator from the cache shared by all backtesters, computing it on a miss
+
+        Parameters:
+        name: (string) name of the indicator
+        params: (tuple) parameters of the indicator
+        compute: (function) no arguments, returns the indicator as an array or a tuple of arrays
+        columns: (tuple) the columns the indicator is worked out from
+
+        Return:
+        read only numpy array, or a tuple of them
+        '''
+        key = (tuple(self._df.fingerprint(c) for c in columns), name, params)
+        return shared_cache.get(key, compute)
+
+    def _stance_machine(self, long_entry, short_entry=None, long_exit=None, short_exit=None, reverse=False, hold=None):
+        '''Turn arrays of entry and exit flags into an array of stances
+
+        When flat go long on a long entry, else short on a short entry.
+        When long go flat on a long exit, when short go flat on a short exit.
+        Exits are only checked from the bar after an entry, and a position that
+        is closed can not be re-opened on the same bar unless reverse is True.
+
+        Rather than stepping through every bar this jumps from one entry or exit
+        to the next, so the cost is in the number of trades not the number of bars.
+
+        Parameters:
+        long_entry: (numpy array) boolean flags to go long
+        short_entry: (numpy array) boolean flags to go short, None for never
+        long_exit: (numpy array) boolean flags to close a long, None for never
+        short_exit: (numpy array) boolean flags to close a short, None for never
+        reverse: (boolean) True if an exit can flip straight into the opposite position on the same bar
+        hold: (int) if set positions are closed this many bars after entry and the exit flags are ignored
+
+        Return:
+        numpy array of stances (1, 0 or -1)
+        '''
+
+        long_entry = np.asarray(long_entry, dtype=bool)
+        n = len(long_entry)
+        never = np.zeros(n, dtype=bool)
+        short_entry = never if short_entry is None else np.asarray(short_entry, dtype=bool)
+        long_exit = never if long_exit is None else np.asarray(long_exit, dtype=bool)
+        short_exit = never if short_exit is None else np.asarray(short_exit, dtype=bool)
+
+        entries = np.flatnonzero(long_entry | short_entry).tolist()
+        exits = {1: np.flatnonzero(long_exit).tolist(), -1: np.flatnonzero(short_exit).tolist()}
+        reverses = {1: short_entry, -1: long_entry}
+
+        # Each position is stored as (stance, start, end) and the stances filled in at the end
+        positions = []
+        current_stance = 0
+        i = 0 # first bar still to be decided
+
+        while True:
+            if current_stance == 0:
+                j = bisect_left(entries, i)
+                if j == len(entries):
+                    break
+                start = entries[j]
+                current_stance = 1 if long_entry[start] else -1
+                i = start + 1 # exits are checked from the next bar
+            else:
+                if hold is not None:
+                    end = start + hold
+                else:
+                    j = bisect_left(exits[current_stance], i)
+                    end = exits[current_stance][j] if j < len(exits[current_stance]) else n
+                if end >= n:
+                    positions.append((current_stance, start, n))
+                    break
+                positions.append((current_stance, start, end))
+                if reverse and reverses[current_stance][end]:
+                    current_stance, start = -current_stance, end
+                else:
+                    current_stance = 0
+                i = end + 1
+
+        stances = np.zeros(n + 1, dtype=int)
+        if positions:
+            stance, start, end = np.array(positions).T
+            # add each stance at its start and take it off at its end, then accumulate
+            np.add.at(stances, start, stance)
+            np.add.at(stances, end, -stance)
+        stances = np.cumsum(stances[:-1])
+
+        return stances
 
 
     def trade_dist(self, figsize=None, ax=None, bins=20, width=1.5):
@@ -94,52 +346,77 @@ class Backtester(object):
 
         self._make_sure_has_run()
 
-        buy = self._df['buy'].dropna()
-        sell = self._df['sell'].dropna()
-        r = []
-        
-        for date, price in buy.iteritems(): # long trades
-            
-            # if you buy but stance is 0 or less then it was a short cover not a new long
-            if self._df.loc[date,'stance']<=0:
-                continue 
-            
-            try:
-                sell_price = sell.loc[date:][0] # find next sell
-                sell_date = sell.loc[date:].index[0] # and the date sold 
-            except IndexError: # its the end of the time series
-                sell_price = self._df['last'].iloc[-1] # current price
-                sell_date = self._df['last'].index[-1] # current date
-            finally:
-                days = (sell_date - date).days 
-                r.append((date,"Long",round(price,6),round(sell_price,6),days,sell_price/price-1))   
+        stance = self._df['stance'].values
+        buy = self._df['buy'].values
+        sell = self._df['sell'].values
+        buys = np.flatnonzero(~np.isnan(buy))
+        sells = np.flatnonzero(~np.isnan(sell))
+
+        # if you buy but stance is 0 or less then it was a short cover not a new long
+        longs = buys[stance[buys] > 0]
+        exits, exit_prices = self._next_exit(longs, sells, sell)
+        ledger = [self._trade_ledger(longs, exits, buy[longs], exit_prices, 'Long')]
 
         if not self._long_only: # short trades
+            # if you sell but stance is 0 or more then it was sale not a new short
+            shorts = sells[stance[sells] < 0]
+            exits, exit_prices = self._next_exit(shorts, buys, buy)
+            ledger.append(self._trade_ledger(shorts, exits, sell[shorts], exit_prices, 'Short'))
 
-            for date, price in sell.iteritems():
+        self._trades = self._trades_frame(ledger) # store for next time
 
-                # if you sell but stance is 0 or more then it was sale not a new short
-                if self._df.loc[date,'stance']>=0:
-                    continue 
+        return self._trades
 
-                try:
-                    cover_price = buy.loc[date:][0] # find next buy
-                    cover_date = buy.loc[date:].index[0] # and the date  
-                except IndexError: # its the end of the time series
-                    cover_price = self._df['last'].iloc[-1] # current price
-                    cover_date = self._df['last'].index[-1] # current date
-                finally:
-                    days = (cover_date - date).days #todo - does this need +1?
-                    r.append((date,"Short",round(price,6),round(cover_price,6),days,price/cover_price-1))  
+    def _next_exit(self, entries, exits, prices):
+        '''For each entry find the first exit on the same bar or later with a binary search
 
-        df = pd.DataFrame(sorted(r, key = lambda x: x[0]))
-        df.columns = ['Date','Type','Entry','Exit','Days','Return%']
-        df['Return%'] = np.round(df['Return%'] * 100,2)
-        df.set_index('Date', inplace=True)
+        Parameters:
+        entries: (numpy array) sorted bar positions of the entries
+        exits: (numpy array) sorted bar positions of the exits
+        prices: (numpy array) exit price for each bar
+
+        Return:
+        Tuple of the exit bar positions and prices. Trades that are still open use the last
+        bar and the current price
+        '''
+        j = np.searchsorted(exits, entries)
+        still_open = j >= len(exits)
+        exit_bars = np.where(still_open, len(self._df) - 1, exits[np.minimum(j, len(exits) - 1)] if len(exits) else 0)
+        exit_prices = np.where(still_open, self._df['last'].values[-1], prices[exit_bars])
+        return exit_bars, exit_prices
 
-        self._trades = df # store for next time
+    def _trade_ledger(self, entries, exits, entry_prices, exit_prices, side):
+        '''Columns of the trades table for one side
 
-        return self._trades
+        Parameters:
+        entries: (numpy array) bar positions of the entries
+        exits: (numpy array) bar positions of the exits
+        entry_prices: (numpy array) price for each entry
+        exit_prices: (numpy array) price for each exit
+        side: (string) "Long" or "Short"
+
+        Return:
+        dict of numpy arrays keyed by column name, with bar positions for the dates
+        '''
+        dates = self._df.index
+        if side == "Long":
+            returns = exit_prices / entry_prices - 1
+        else:
+            returns = entry_prices / exit_prices - 1
+        return {'Date': entries, 'Type': np.repeat(side, len(entries)), 'Entry': np.round(entry_prices, 6),
+                'Exit': np.round(exit_prices, 6), 'Days': np.asarray((dates[exits] - dates[entries]).days),
+                'Return%': returns}
+
+    def _trades_frame(self, ledger):
+        '''Combine the columns from _trade_ledger() into a trades table ordered by date'''
+        columns = ['Date','Type','Entry','Exit','Days','Return%']
+        data = dict((c, np.concatenate([np.asarray(l[c]) for l in ledger])) for c in columns)
+        order = np.argsort(data['Date'], kind='mergesort')
+        df = pd.DataFrame(dict((c, data[c][order]) for c in columns[1:]), columns=columns[1:])
+        df.insert(0, 'Date', self._df.index[data['Date'][order]])
+        df['Return%'] = np.round(df['Return%'] * 100,2)
+        df.set_index('Date', inplace=True)
+        return df
 
     def plot(self, start_date=None, end_date=None, figsize=None, ax=None):
         '''Plot of prices and the the buy and sell points
@@ -183,7 +460,7 @@ class Backtester(object):
             returns = (self._df['strategy']-self._df['market']).copy()
         original_returns = returns.copy()
         returns_index = returns.resample('MS').first().index
-        returns_values = self._sum_returns(returns, (returns.index.year, returns.index.month)).values
+        returns_values = self._sum_returns(returns, [returns.index.year, returns.index.month]).values
         #set_trace()
         returns = pd.DataFrame(index=returns_index, data={'Returns': returns_values})
 
@@ -219,62 +496,89 @@ class Backtester(object):
         plt.yticks(rotation=0)
         plt.show()
 
-    def _max_dd(self, xs, ds, depth = 5):
-        '''
-        Create a list of largest drawdowns recursively
-         
+    def _drawdown_episodes(self, series):
+        '''Find every drawdown in one pass over the running maximum
+
+        An episode starts at a high, runs while the price is below that high and ends
+        when the price gets back to it (the recovery).
+
         Parameters:
-        xs: (numpy array) of prices
-        ds: (numpy array) of dates
-         
+        series: (Panda Series) of prices
+
         Return:
-        A list of tuples with drawdown size, high and low value, high and low date
+        DataFrame with one row per episode sorted by drawdown size, largest first
         '''
 
-        if depth <= 0:
-            return []
-        try:
-            i = np.argmax( (np.maximum.accumulate(xs) - xs) / xs ) #low
-            j = np.argmax(xs[:i]) #high
-            dd = np.round( (1- xs[i]/xs[j]) * 100, 2) #drawdown size
-            return [(dd,xs[j],xs[i],ds[j],ds[i])] + self._max_dd(xs[:j],ds[:j],depth-1) + self._max_dd(xs[i:],ds[i:],depth-1)
-        except:
-            return []
+        xs = np.round(np.array(series.values),5)
+        ds = series.index
+        n = len(xs)
+
+        peak = np.maximum.accumulate(xs)
+        under = (xs < peak).astype(np.int8)
+        edges = np.diff(np.concatenate(([0], under, [0])))
+        starts = np.flatnonzero(edges == 1) # first bar below the high
+        ends = np.flatnonzero(edges == -1) # first bar back at the high, n if not recovered yet
+        if len(starts) == 0: # never below its high, e.g. a rising market or a strategy that never trades
+            none, dates = np.array([]), ds[:0]
+            return pd.DataFrame({'dd': none, 'high': none, 'low': none, 'highd': dates, 'lowd': dates,
+                                 'days': dates - dates, 'recoveryd': dates, 'rdays': dates - dates,
+                                 'duration': dates - dates, 'recovered': np.array([], dtype=bool)},
+                                columns=['dd', 'high', 'low', 'highd', 'lowd', 'days', 'recoveryd', 'rdays',
+                                         'duration', 'recovered'])
+
+        # lowest point of each episode, the first one if it is hit more than once
+        marker = np.zeros(n, dtype=int)
+        marker[starts] = 1
+        episode = np.cumsum(marker) - 1
+        lows = np.minimum.reduceat(xs, starts)
+        at_low = np.flatnonzero((episode >= 0) & (xs == lows[np.maximum(episode, 0)]) & (under == 1))
+        first = np.concatenate(([True], np.diff(episode[at_low]) != 0)) if len(at_low) else np.array([], dtype=bool)
+        low_i = at_low[first]
+
+        high_i = starts - 1
+        recovered = ends < n
+        recoveryd = ds[np.minimum(ends, n - 1)] # has not recovered yet, use "todays" date
+
+        df = pd.DataFrame({'dd': np.round((1 - xs[low_i]/xs[high_i]) * 100, 2), 'high': xs[high_i], 'low': xs[low_i],
+                           'highd': ds[high_i], 'lowd': ds[low_i]}, columns=['dd', 'high', 'low', 'highd', 'lowd'])
+        df['days'] = (df['lowd'] - df['highd'])
+        df['recoveryd'] = recoveryd
+        df['rdays'] = df['recoveryd'] - df['lowd']
+        df['duration'] = df['recoveryd'] - df['highd']
+        df['recovered'] = recovered
+
+        df = df.iloc[np.argsort(-df['dd'].values, kind='mergesort')]
+        return df.reset_index(drop=True)
+
 
+    def _drawdown_series(self, target, start=0):
+        '''Prices from bar start for the drawdowns of the strategy or the market'''
+        name = 'strategy_last' if target == "strategy" else 'last'
+        values = self._df.array(name)[start:]
+        series = pd.Series(values, index=self._df.index[start:])
+        return series[~np.isnan(values)]
 
     def drawdowns(self, target="strategy", cutoff = 25):
         '''Create a list of drawdowns
 
+        Every episode is worked out once per target and cached, cutoff just filters it
+
         Parameters:
         target: (string) set to "strategy" or "market"
-        cutoff: (int) only show drawdowns larger than this, eg 25 is 25%
+        cutoff: (int) only show drawdowns larger than this, eg 25 is 25%, 0 for all of them
 
         Return:
         DataFrame with a table of drawdowns
         '''
         self._make_sure_has_run()
-        if target == "strategy":
-            series = self._df['strategy_last'].dropna() 
+        if target not in self._drawdowns:
+            series = self._drawdown_series(target)
+            self._drawdowns[target] = self._drawdown_episodes(series)
+            self._drawdown_highs[target] = (_last_high(series), len(self._df))
         else:
-            series = self._df['last'].dropna() 
-        xs = np.round(np.array(series.values),5)
-        ds = series.index
-        dds = self._max_dd(xs, ds)
-        dds.sort()
-        dds = dds[::-1]
+            self._extend_drawdowns(target)
 
-        df = pd.DataFrame(dds,columns =['dd', 'high', 'low', 'highd', 'lowd'])
-        df['days'] = (df['lowd'] - df['highd'])
-        recoveryd = []
-        for index, row in df.iterrows():
-            try:
-                temp = series.loc[row['lowd']:]
-                recoveryd.append(temp[temp > row['high']].index[0])
-            except:
-                recoveryd.append(series.index[-1]) # has not recovered yet, use "todays" date
-                continue
-        df['recoveryd'] = recoveryd
-        df['rdays'] = df['recoveryd'] - df['lowd']
+        df = self._drawdowns[target]
         return df[df['dd'] >= cutoff]
 
 
@@ -286,88 +590,223 @@ class Backtester(object):
 
     def _market_returns(self):
 
-        self._df['market'] = np.log(self._df['last'] / self._df['last'].shift(1))
+        last = self._df.array('last')
+        self._df['market'] = self._cached('log_returns', (), lambda: np.log(last / _shift(last)))
 
         # For buy, sell, and trade calculation shift(1) leads to a value of NA for first entry which then differs from 0
         # This was fixed by doing a fillna(0) after the shift(1)
 
-        self._df['buy'] = np.where( self._df['stance'] - self._df['stance'].shift(1).fillna(0) > 0, self._df['last'], np.NAN)
-        self._df['sell'] = np.where( self._df['stance'] - self._df['stance'].shift(1).fillna(0) < 0, self._df['last'], np.NAN)
+        stance = self._df.array('stance')
+        change = stance - _fill(_shift(stance), 0)
+        with np.errstate(invalid='ignore'):
+            self._df['buy'] = np.where(change > 0, last, np.NAN)
+            self._df['sell'] = np.where(change < 0, last, np.NAN)
 
 
     def _run(self):
         """
         Runs the strategy and calculates returns and performance
         This only gets run when needed on a lazy basis
+        Works on the numpy arrays of the column store, no DataFrame is built
         """
 
         if self._has_run:
             return
 
+        self._inputs = list(self._df) # the columns the strategy was given, append() needs them all
         self._trade_logic()
         self._market_returns()
+        self._returns()
+
+    def _returns(self):
+        '''Work out the trades, returns, running totals and results from the stances'''
+
+        stance = self._df.array('stance')
+        prev_stance = _shift(stance)
+        prev_stance0 = _fill(prev_stance, 0)
 
         # apply slippage
         # If I trade today and stance == 1 then reduce market return 
-        self._df['trade'] = np.where(self._df['stance'] != self._df['stance'].shift(1).fillna(0), 1, 0)
-        self._df['trade_size'] = np.abs(self._df['stance'] - self._df['stance'].shift(1).fillna(0))
-        self._df['market_adj'] = self._df['market'] - (self._df['trade_size'].shift(1) * self._slippage * self._df['stance'].shift(1))       
+        self._df['trade'] = np.where(stance != prev_stance0, 1, 0)
+        self._df['trade_size'] = np.abs(stance - prev_stance0)
+        self._df['market_adj'] = self._df.array('market') - (_shift(self._df.array('trade_size')) * self._slippage * prev_stance)
 
         # If I get a buy trigger today then I can buy at todays close (tomorrow's open) and thus get tomorrow's return
 
-        self._df['strategy'] = self._df['market_adj'] * self._df['stance'].shift(1) #shift(1) means day before
-        self._df['strategy_last'] = self._df['strategy'].cumsum().apply(np.exp).dropna()
+        self._df['strategy'] = self._df.array('market_adj') * prev_stance #shift(1) means day before
+        strategy_returns = self._df.array('strategy')
+        self._df['strategy_last'] = np.exp(_cumsum(strategy_returns))
+
+        # since we are using log returns multiplying by -1 for shorts works
+
+        self._start_totals()
+
+        market_returns = self._df.array('market')
+        strategy_returns = strategy_returns[~np.isnan(strategy_returns)]
+        market_returns = market_returns[~np.isnan(market_returns)]
+        self._results = self._summary(_cumsum(self._df.array('strategy'))[-1], _cumsum(self._df.array('market'))[-1],
+                                      (np.average(strategy_returns), np.std(strategy_returns)),
+                                      (np.average(market_returns), np.std(market_returns)))
+        self._has_run = True
+
+    def _summary(self, strategy, market, strategy_stats, market_stats):
+        '''Put together the results from the running totals
+
+        Parameters:
+        strategy: (float) total strategy log return
+        market: (float) total market log return
+        strategy_stats: (tuple) mean and standard deviation of the strategy log returns
+        market_stats: (tuple) the same for the market
+        '''
 
         # since we are using log returns multiplying by -1 for shorts works
 
-        start_date, end_date = self._df.index[0], self._df.index[-1]
+        index = self._df.index
+        totals = self._totals
+        start_date, end_date = index[0], index[-1]
         years = (end_date - start_date).days / 365.25
         
-        trades = self._df['trade'].sum()
-        market = ((np.exp(self._df['market'].cumsum()[-1]) - 1) * 100)
+        trades = totals['trades']
+        market = ((np.exp(market) - 1) * 100)
         market_pa = ((market / 100 + 1) ** (1 / years) - 1) * 100
-        strategy = ((np.exp(self._df['strategy'].cumsum()[-1]) - 1) * 100)
+        strategy = ((np.exp(strategy) - 1) * 100)
         strategy_pa = ((strategy / 100 + 1) ** (1 / years) - 1) * 100
 
         # Calculating sharpe using log returns
         # For daily data you annualise with sqrt(365.25)
         # Work out how many periods per year
 
-        days = (self._df.index[1] - self._df.index[0]).days
-        secs = (self._df.index[1] - self._df.index[0]).seconds
+        days = (index[1] - index[0]).days
+        secs = (index[1] - index[0]).seconds
         periods_per_year = 365.25 / (days + secs / 3600.0 / 24.0)
 
-        sharpe = math.sqrt(periods_per_year) * np.average(self._df['strategy'].dropna()) / np.std(self._df['strategy'].dropna())
-        market_sharpe = math.sqrt(periods_per_year) * np.average(self._df['market'].dropna()) / np.std(self._df['market'].dropna())
+        sharpe = math.sqrt(periods_per_year) * strategy_stats[0] / strategy_stats[1]
+        market_sharpe = math.sqrt(periods_per_year) * market_stats[0] / market_stats[1]
 
         # Current trade unrealised profit or loss
-        current_stance = self._df['stance'].iloc[-1]
-        last = self._df['last'].iloc[-1]
+        current_stance = self._df.array('stance')[-1]
+        last = self._df.array('last')[-1]
         if current_stance == 1:
-            entry = self._df['buy'].dropna()[-1]
+            entry = totals['buy']
             unrealised = (last / entry - 1) * 100
         elif current_stance == -1:
-            entry = self._df['sell'].dropna()[-1]
+            entry = totals['sell']
             unrealised = (entry / last - 1) * 100
         else:
             unrealised = 0
 
-        if 0 in self._df.stance.value_counts().index:
-            time_in_market = 1 - float(self._df.stance.value_counts()[0]) / float(self._df.stance.count())
-        else:
-            time_in_market = 1
-
-        time_long = float(self._df.stance.value_counts()[1]) / float(self._df.stance.count())
-        time_short = float(self._df.stance.value_counts()[-1]) / float(self._df.stance.count())
+        count, flat, long, short = totals['stances']
+        count = float(count)
+        time_in_market = 1 - flat / count
+        time_long = long / count
+        time_short = short / count
 
         time_in_market = np.round(time_in_market * 100, 2)
         time_long = np.round(time_long * 100, 2)
         time_short = np.round(time_short * 100, 2)
 
-        self._results = {"Strategy":np.round(strategy,2), "Market":np.round(market,2),"Trades":trades,"Sharpe":np.round(sharpe,2),
-                        "Strategy_pa": np.round(strategy_pa,2), "Market_pa": np.round(market_pa,2), "Years": np.round(years,2),
-                        "Trades_per_month":np.round(trades/years/12,2),"Market_sharpe":np.round(market_sharpe,2),
-                        'Current_stance':current_stance,"Unrealised":np.round(unrealised,2),'Time_in_market':time_in_market,
-                        'Time_long':time_long, 'Time_short': time_short, 'Start_date': self._start_date, 'End_date': self._end_date}
-        self._has_run = True
+        return {"Strategy":np.round(strategy,2), "Market":np.round(market,2),"Trades":trades,"Sharpe":np.round(sharpe,2),
+                "Strategy_pa": np.round(strategy_pa,2), "Market_pa": np.round(market_pa,2), "Years": np.round(years,2),
+                "Trades_per_month":np.round(trades/years/12,2),"Market_sharpe":np.round(market_sharpe,2),
+                'Current_stance':current_stance,"Unrealised":np.round(unrealised,2),'Time_in_market':time_in_market,
+                'Time_long':time_long, 'Time_short': time_short, 'Start_date': self._start_date, 'End_date': self._end_date}
+
+    def _start_totals(self):
+        '''Running totals behind results(), append() carries them forward'''
+        self._totals = {'trades': 0, 'strategy': 0.0, 'market': 0.0, 'strategy_moments': (0, 0.0, 0.0),
+                        'market_moments': (0, 0.0, 0.0), 'stances': (0, 0, 0, 0), 'buy': np.nan, 'sell': np.nan}
+        self._add_totals(0)
+
+    def _add_totals(self, start):
+        '''Add the rows from start to the end into the running totals'''
+        totals = self._totals
+        stance = self._df.array('stance')[start:]
+        totals['trades'] += self._df.array('trade')[start:].sum()
+        for name in ('strategy', 'market'):
+            returns = self._df.array(name)[start:]
+            returns = returns[~np.isnan(returns)]
+            count, total, squares = totals[name + '_moments']
+            totals[name + '_moments'] = (count + len(returns), total + returns.sum(), squares + np.dot(returns, returns))
+            if len(returns):
+                totals[name] = _cumsum(np.concatenate(([totals[name]], returns)))[-1] # same order of adding as a cumsum
+        count, flat, long, short = totals['stances']
+        totals['stances'] = (count + np.count_nonzero(~np.isnan(stance)), flat + np.count_nonzero(stance == 0),
+                             long + np.count_nonzero(stance == 1), short + np.count_nonzero(stance == -1))
+        for name in ('buy', 'sell'):
+            prices = self._df.array(name)[start:]
+            prices = prices[~np.isnan(prices)]
+            if len(prices):
+                totals[name] = prices[-1]
+
+
+# method -> phase reported by profile()
+_PROFILED = {'_trade_logic': 'Trade_logic', '_market_returns': 'Market_returns', '_run': 'Stats',
+             'append': 'Append', 'trades': 'Trades', 'drawdowns': 'Drawdowns'}
+
+
+class _Profiler(object):
+    '''Seconds spent in each phase. Time is only counted to the innermost phase, so a phase
+    that calls another (_run calls _trade_logic) does not count the inner one's time.
+    Backtesters that share one (a portfolio and its strategies) add up into it.
+    '''
 
+    def __init__(self):
+        self.seconds = dict((phase, 0.0) for phase in _PROFILED.values())
+        self.bars = 0
+        self._stack = [] # [phase, time it was last started or resumed]
+
+    def timed(self, phase, method, bars=None):
+        '''Wrap a method so its time is added to phase, bars counts what it went through'''
+        def wrapper(*args, **kwargs):
+            now = time.perf_counter()
+            if self._stack: # pause the phase this one runs inside
+                self.seconds[self._stack[-1][0]] += now - self._stack[-1][1]
+            self._stack.append([phase, now])
+            try:
+                return method(*args, **kwargs)
+            finally:
+                now = time.perf_counter()
+                self.seconds[phase] += now - self._stack.pop()[1]
+                if self._stack:
+                    self._stack[-1][1] = now
+                if bars is not None:
+                    self.bars += bars()
+        return wrapper
+
+    def summary(self):
+        total = sum(self.seconds.values())
+        profile = dict(self.seconds)
+        profile.update({'Total': total, 'Bars': self.bars, 'Bars_per_sec': self.bars / total if total else np.nan})
+        return profile
+
+
+def _shift(values):
+    '''Numpy version of Series.shift(1), always returns floats'''
+    shifted = np.empty(len(values))
+    shifted[0] = np.nan
+    shifted[1:] = values[:-1]
+    return shifted
+
+def _fill(values, value):
+    '''Numpy version of Series.fillna(value)'''
+    return np.where(np.isnan(values), value, values)
+
+def _cumsum(values):
+    '''Numpy version of Series.cumsum(), NaNs are skipped but kept in place'''
+    nans = np.isnan(values)
+    return np.where(nans, np.nan, np.cumsum(np.where(nans, 0, values)))
+
+def _last_valid(values):
+    '''Last value that is not NaN'''
+    return values[~np.isnan(values)][-1]
+
+def _mean_std(moments):
+    '''Mean and standard deviation from (count, sum, sum of squares)'''
+    count, total, squares = moments
+    mean = total / count
+    return mean, math.sqrt(max(squares / count - mean * mean, 0))
+
+def _last_high(series):
+    '''Date of the last bar at the running high, rounded as for the drawdown table'''
+    xs = np.round(np.array(series.values),5)
+    return series.index[np.flatnonzero(xs == np.maximum.accumulate(xs))[-1]]
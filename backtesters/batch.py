@@ -0,0 +1,145 @@
+'''Run many strategy configurations across many price series on a pool of processes.
+
+Every price series is copied once into shared memory before the pool starts, so the
+workers only receive small (class, params, series key) specs and read the prices in place.
+'''
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+import pandas as pd
+
+# Set in each worker process by _init_worker
+_values = None
+_dates = None
+_layout = {}
+_series = {}
+
+
+def run_batch(specs, series_map, workers=None, chunksize=None):
+    '''Backtest every spec and collect the results into one DataFrame
+
+    Parameters:
+    specs: (list) of (class, params, key) tuples. class is a Backtester subclass, params a dict
+        of keyword arguments for it and key the name of a series in series_map. key can also be
+        a tuple of names which are passed in order as the positional arguments, e.g. ('btc', 'btc_high', 'btc_low')
+    series_map: (dict) name -> Pandas Series of prices by date
+    workers: (int) number of processes, defaults to the number of cores. 1 runs everything in this process
+    chunksize: (int) number of specs sent to a worker at a time, defaults to an even split
+
+    Return:
+    DataFrame with one row per spec: Backtester, Series and Params followed by the results() of the backtest
+    '''
+
+    specs = [(cls, dict(params or {}), key) for cls, params, key in specs]
+    keys = set()
+    for _, _, key in specs:
+        keys.update(key if isinstance(key, tuple) else (key,))
+    missing = keys - set(series_map)
+    if missing:
+        raise KeyError('Series not in series_map: %s' % ', '.join(sorted(str(k) for k in missing)))
+
+    rows = map_shared(_run_spec, specs, dict((k, series_map[k]) for k in keys), workers=workers, chunksize=chunksize)
+
+    results = pd.DataFrame([r for _, r in rows])
+    results.insert(0, 'Params', [str(params) for _, params, _ in specs])
+    results.insert(0, 'Series', [', '.join(key) if isinstance(key, tuple) else key for _, _, key in specs])
+    results.insert(0, 'Backtester', [name for name, _ in rows])
+    return results
+
+
+def map_shared(func, tasks, series_map, workers=None, chunksize=None):
+    '''Call func on every task on a pool of processes with the series in shared memory
+
+    func must be a module level function, it can get the prices with shared_series(key)
+
+    Parameters:
+    func: (function) called with each task
+    tasks: (list) small picklable tasks
+    series_map: (dict) name -> Pandas Series of prices by date
+    workers: (int) number of processes, defaults to the number of cores. 1 runs everything in this process
+    chunksize: (int) number of tasks sent to a worker at a time, defaults to an even split
+
+    Return:
+    list of what func returned for each task, in order
+    '''
+
+    values, dates, layout = _share(series_map)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+
+    if workers == 1:
+        global _values, _dates, _layout, _series
+        outer = _values, _dates, _layout, _series # a call from inside a mapped function gets its series back
+        _init_worker(values, dates, layout)
+        try:
+            return [func(task) for task in tasks]
+        finally:
+            _values, _dates, _layout, _series = outer
+
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(values, dates, layout))
+    try:
+        return pool.map(func, tasks, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def shared_series(key):
+    '''Series over the shared arrays for a key, the prices are not copied'''
+    if key not in _series:
+        offset, n, name, tz = _layout[key]
+        index = pd.DatetimeIndex(_dates[offset:offset + n].view('M8[ns]'))
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        _series[key] = pd.Series(_values[offset:offset + n], index=index, name=name)
+    return _series[key]
+
+
+def _share(series_map):
+    '''Copy every series into two shared arrays, one for the values and one for the dates
+
+    Return:
+    (values, dates, layout) where layout maps each key to (offset, length, name, tz)
+    '''
+
+    total = sum(len(s) for s in series_map.values())
+    values = RawArray(ctypes.c_double, max(total, 1))
+    dates = RawArray(ctypes.c_int64, max(total, 1))
+    shared_values = np.frombuffer(values, dtype=np.float64)
+    shared_dates = np.frombuffer(dates, dtype=np.int64)
+
+    layout = {}
+    offset = 0
+    for key, s in series_map.items():
+        n = len(s)
+        index = pd.DatetimeIndex(s.index)
+        tz = str(index.tz) if index.tz is not None else None
+        if tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        shared_values[offset:offset + n] = np.asarray(s.values, dtype=np.float64)
+        shared_dates[offset:offset + n] = index.values.view(np.int64)
+        layout[key] = (offset, n, s.name, tz)
+        offset += n
+
+    return values, dates, layout
+
+
+def _init_worker(values, dates, layout):
+    '''Point the worker at the shared arrays, Series are only built when a spec needs them'''
+    global _values, _dates, _layout, _series
+    _values = None if values is None else np.frombuffer(values, dtype=np.float64)
+    _dates = None if dates is None else np.frombuffer(dates, dtype=np.int64)
+    _layout = layout
+    _series = {}
+
+
+def _run_spec(spec):
+    cls, params, key = spec
+    args = [shared_series(k) for k in (key if isinstance(key, tuple) else (key,))]
+    return cls.__name__, dict(cls(*args, **params).results())
@@ -4,10 +4,8 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, talib
 from datetime import timedelta
-import talib
 from backtester import Backtester
 
 class BollingerMR(Backtester):
@@ -74,52 +72,20 @@ class BollingerMR(Backtester):
         a set of stances
         '''
 
-        self._df['trend'] = self._df['last'].rolling(window=self._trend).mean()
-        self._df['upper'], self._df['middle'], self._df['lower'] = talib.BBANDS(self._df['last'], timeperiod=self._lookback)
+        self._df['trend'] = self._cached('rolling_mean', (self._trend,), lambda: self._df['last'].rolling(window=self._trend).mean())
+        self._df['upper'], self._df['middle'], self._df['lower'] = self._cached('bbands', (self._lookback, 2, 2),
+            lambda: talib.BBANDS(self._df['last'], timeperiod=self._lookback))
         B = (self._df['last'] - self._df['lower']) / (self._df['upper'] - self._df['lower']) # %B
         self._df['B%'] = B.rolling(window=3).mean() # smoothed version of %B
         
-        current_stance = 0
-        stances = []
-
-
-        for index in np.arange(0,len(self._df)):
-
-            long_signal = False
-            short_signal = False
-            long_close = False
-            short_close = False
-            close = self._df['last'].iloc[index]
-            
-            if close >= self._df['trend'].iloc[index]:
-                if self._df['B%'].iloc[index] < self._threshhold: 
-                    long_signal = True
-
-            if close < self._df['trend'].iloc[index]:
-                if self._df['B%'].iloc[index] > (1-self._threshhold):
-                    short_signal = True
-
-            if self._df['B%'].iloc[index] > (1-self._threshhold):
-                long_close = True
-
-            if self._df['B%'].iloc[index] < self._threshhold:
-                short_close = True
-
-            if current_stance == 0:
-                if long_signal:
-                    current_stance = 1
-                elif short_signal:
-                    current_stance = -1
-            elif current_stance == 1:
-                if long_close:
-                    current_stance = 0
-            elif current_stance == -1:
-                if short_close:
-                    current_stance = 0
-
-            stances.append(current_stance)
-
-        self._df['stance'] = stances
-        
-        
+        close = self._df['last'].values
+        trend = self._df['trend'].values
+        B = self._df['B%'].values
+
+        with np.errstate(invalid='ignore'):
+            long_signal = (close >= trend) & (B < self._threshhold)
+            short_signal = (close < trend) & (B > (1-self._threshhold))
+            long_close = B > (1-self._threshhold)
+            short_close = B < self._threshhold
 
+        self._df['stance'] = self._stance_machine(long_signal, short_signal, long_close, short_close)
@@ -4,10 +4,8 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, talib
 from datetime import timedelta
-import talib
 from backtester import Backtester
 
 class BollingerMomentum(Backtester):
@@ -64,48 +62,15 @@ class BollingerMomentum(Backtester):
         self._df['upper'], self._df['middle'], self._df['lower'] = talib.BBANDS(self._df['last'],
             timeperiod=self._lookback, nbdevup=self._distance,nbdevdn=self._distance)
         
-        current_stance = 0
-        stances = []
-
-
-        for index in np.arange(0,len(self._df)):
-
-            long_signal = False
-            short_signal = False
-            long_close = False
-            short_close = False
-            close = self._df['last'].iloc[index]
-            
-            if close >= self._df['upper'].iloc[index]:
-                long_signal = True
-
-            if close < self._df['lower'].iloc[index]:
-                short_signal = True
-
-            if close <= self._df['middle'].iloc[index]:
-                long_close = True
-
-            if close >= self._df['middle'].iloc[index]:
-                short_close = True
-
-            if current_stance == 0:
-                if long_signal:
-                    current_stance = 1
-                elif short_signal:
-                    current_stance = -1
-            elif current_stance == 1:
-                if long_close:
-                    current_stance = 0
-                    if short_signal:
-                        current_stance = -1
-            elif current_stance == -1:
-                if short_close:
-                    current_stance = 0
-                    if long_signal:
-                        current_stance = 1
-
-            stances.append(current_stance)
-
-        self._df['stance'] = stances
-        
-    
\ No newline at end of file
+        close = self._df['last'].values
+        upper = self._df['upper'].values
+        middle = self._df['middle'].values
+        lower = self._df['lower'].values
+
+        with np.errstate(invalid='ignore'):
+            long_signal = close >= upper
+            short_signal = close < lower
+            long_close = close <= middle
+            short_close = close >= middle
+
+        self._df['stance'] = self._stance_machine(long_signal, short_signal, long_close, short_close, reverse=True)
@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from backtester import Backtester
 
 class BuyIfUpBacktester(Backtester):
@@ -28,6 +27,9 @@ class BuyIfUpBacktester(Backtester):
             self._lookback, str(self._long_only), str(self._start_date), str(self._end_date))
 
 
+    def _warmup(self):
+        return self._lookback
+
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
         a set of stances
@@ -0,0 +1,188 @@
+'''Column store used by the backtesters. Each series is held as a numpy array keyed by name
+and a DataFrame is only put together when something asks for one.
+'''
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from indicator_cache import fingerprint
+
+
+class Columns(object):
+    '''Numpy arrays sharing one index, with enough of the DataFrame interface for the strategies
+
+    Getting a column returns a Series over the stored array (no copy) and setting a column
+    stores an array, aligning a Series on the index first just like a DataFrame would.
+    Anything else (loc, resample, plotting, value_counts...) is passed on to a DataFrame
+    that is built on first use and thrown away when a column changes.
+
+    Parameters:
+    index: (Pandas Index) the dates shared by every column
+    '''
+
+    def __init__(self, index):
+        self._index = index
+        self._length = len(index)
+        self._dates = None # buffer for the dates once rows have been appended
+        self._tz = None
+        self._buffers = {}
+        self._data = OrderedDict()
+        self._frame = None
+        self._fingerprints = {}
+        self._index_fingerprint = None
+
+    @classmethod
+    def from_frame(cls, df):
+        '''Create a column store holding the columns of a DataFrame'''
+        columns = cls(df.index)
+        for name in df.columns:
+            columns._data[name] = df[name].values
+        return columns
+
+    @property
+    def index(self):
+        if self._index is None:
+            # naive dates are a view of the buffer, nothing is copied
+            self._index = pd.DatetimeIndex(self._dates[:self._length])
+            if self._tz is not None:
+                self._index = self._index.tz_localize('UTC').tz_convert(self._tz)
+        return self._index
+
+    def append(self, index, data):
+        '''Add rows to the end of every column
+
+        Columns are kept in buffers with room to spare, so adding a few rows at a time
+        costs the number of new rows rather than the length of the history.
+
+        Parameters:
+        index: (Pandas Index) dates of the new rows
+        data: (dict) column name -> values for the new rows, other columns get NaN (0 if they hold integers)
+        '''
+
+        n, m = self._length, len(index)
+        if isinstance(index, pd.DatetimeIndex) and isinstance(self.index, pd.DatetimeIndex):
+            if self._dates is None or len(self._dates) < n + m:
+                dates = np.empty(max(n + m, 2 * n), dtype='M8[ns]')
+                current = self.index
+                self._tz = current.tz
+                dates[:n] = current.tz_convert('UTC').tz_localize(None).values if current.tz is not None else current.values
+                self._dates = dates
+            index = pd.DatetimeIndex(index)
+            if index.tz is not None:
+                index = index.tz_convert('UTC').tz_localize(None)
+            self._dates[n:n + m] = index.values
+            self._index = None
+        else:
+            self._index = self.index.append(index)
+            self._dates = None
+
+        self._length = n + m
+        for name in list(self._data.keys()):
+            if name in data:
+                values = np.asarray(data[name])
+            else:
+                values = np.zeros(m, dtype=self._data[name].dtype) if self._data[name].dtype.kind in 'iub' else np.nan
+            self._grow(name, n, np.result_type(self._data[name], values))
+            self._buffers[name][n:n + m] = values
+            self._data[name] = self._buffers[name][:n + m]
+        self._frame = None
+        self._fingerprints = {}
+        self._index_fingerprint = None
+
+    def write(self, name, start, values):
+        '''Overwrite a column from row start to the end, the column is created (NaN) if it is new'''
+        values = np.asarray(values)
+        if name not in self._data:
+            self._data[name] = np.full(self._length, np.nan, dtype=np.result_type(values, np.float64))
+        self._grow(name, self._length, np.result_type(self._data[name], values))
+        self._buffers[name][start:self._length] = values
+        self._data[name] = self._buffers[name][:self._length]
+        self._frame = None
+        self._fingerprints.pop(name, None)
+
+    def take(self, start):
+        '''A new column store with copies of the rows from start to the end'''
+        columns = Columns(self.index[start:])
+        for name, values in self._data.items():
+            columns._data[name] = values[start:].copy()
+        return columns
+
+    def _grow(self, name, n, dtype):
+        '''Make sure a column lives in a writable buffer of the right type with room for the rows'''
+        values, buf = self._data[name], self._buffers.get(name)
+        if buf is None or values.base is not buf or len(buf) < self._length or buf.dtype != dtype:
+            buf = np.empty(max(self._length, 2 * n), dtype=dtype)
+            buf[:n] = values[:n]
+            self._buffers[name] = buf
+
+    def array(self, name):
+        '''The numpy array behind a column'''
+        return self._data[name]
+
+    def fingerprint(self, name):
+        '''Fingerprint of a column for the indicator cache, worked out once per column'''
+        if name not in self._fingerprints:
+            self._fingerprints[name] = fingerprint(self._data[name])
+        return self._fingerprints[name]
+
+    def index_fingerprint(self):
+        '''Fingerprint of the dates, for things worked out from the dates rather than a column'''
+        if self._index_fingerprint is None:
+            self._index_fingerprint = fingerprint(self.index.asi8)
+        return self._index_fingerprint
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._data.keys()))
+
+    @property
+    def frame(self):
+        '''All the columns as a DataFrame, built once and reused until a column changes'''
+        if self._frame is None:
+            self._frame = pd.DataFrame(self._data, index=self.index, columns=list(self._data.keys()))
+        return self._frame
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, pd.Index)):
+            return pd.DataFrame(OrderedDict((k, self._data[k]) for k in key), index=self.index, columns=list(key))
+        return pd.Series(self._data[key], index=self.index, name=key)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, pd.Series) and not value.index.equals(self.index):
+            value = value.reindex(self.index)
+        value = np.asarray(value)
+        if value.ndim == 0:
+            value = np.full(self._length, value[()], dtype=value.dtype)
+        elif len(value) != self._length:
+            raise ValueError('Length of values does not match length of index')
+        elif any(np.may_share_memory(value, a) for a in self._data.values()):
+            value = value.copy() # columns never share memory, as in a DataFrame
+        self._data[key] = value
+        self._frame = None
+        self._fingerprints.pop(key, None)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._frame = None
+        self._fingerprints.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return self._length
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the store, so hand them to the DataFrame
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.frame, name)
+
+    def __repr__(self):
+        return repr(self.frame)
+
+    def _repr_html_(self):
+        return self.frame._repr_html_()
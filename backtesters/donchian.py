@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from datetime import timedelta
 from backtester import Backtester
 
@@ -36,50 +35,17 @@ class DonchianBacktester(Backtester):
         a set of stances
         '''
         
-        current_stance = 0
-        stances = []
-
         long_entry_level = self._df['last'].rolling(window=self._entry).max()
         long_exit_level = self._df['last'].rolling(window=self._exit).min()
         short_entry_level = self._df['last'].rolling(window=self._entry).min()
         short_exit_level = self._df['last'].rolling(window=self._exit).max()
 
+        close = self._df['last'].values
 
-        for index in np.arange(0,len(self._df)):
-
-            long_signal = False
-            short_signal = False
-            long_close = False
-            short_close = False
-            close = self._df['last'].iloc[index]
-            
-            if close >= long_entry_level[index]:
-                long_signal = True
-
-            if close <= short_entry_level[index]:
-                short_signal = True
-
-            if close <= long_exit_level[index]:
-                long_close = True
-
-            if close >= short_exit_level[index]:
-                short_close = True
-
-            if current_stance == 0:
-                if long_signal:
-                    current_stance = 1
-                elif short_signal:
-                    current_stance = -1
-            elif current_stance == 1:
-                if long_close:
-                    current_stance = 0
-            elif current_stance == -1:
-                if short_close:
-                    current_stance = 0
-
-            stances.append(current_stance)
-
-        self._df['stance'] = stances
-        
-        
+        with np.errstate(invalid='ignore'):
+            long_signal = close >= long_entry_level.values
+            short_signal = close <= short_entry_level.values
+            long_close = close <= long_exit_level.values
+            short_close = close >= short_exit_level.values
 
+        self._df['stance'] = self._stance_machine(long_signal, short_signal, long_close, short_close)
@@ -0,0 +1,121 @@
+'''Indicator cache shared by all strategy instances in a process.
+
+Strategies built on the same prices (the voters of a MajoritySignalBacktester, the parts of a
+PortfolioBacktester, a parameter sweep) ask for the same rolling means, bollinger bands, ATR's
+and log returns over and over. Indicators are stored against (series fingerprint, indicator, params)
+so each distinct one is only worked out once, and the least recently used are dropped once the
+memory cap is reached.
+'''
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+def fingerprint(values):
+    '''Identify an array by its dtype, length and a hash of its contents
+
+    Indicators are worked out position by position so the dates are not part of the fingerprint
+    '''
+    values = np.ascontiguousarray(values)
+    return (values.dtype.str, len(values), hashlib.sha1(values).hexdigest())
+
+
+class IndicatorCache(object):
+    '''Least recently used cache of indicator arrays with a cap on memory
+
+    Parameters:
+    max_bytes: (int) memory cap, the least recently used indicators are evicted to stay under it.
+        0 turns caching off
+    '''
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def get(self, key, compute):
+        '''Return the indicator stored under key, calling compute() to work it out on a miss
+
+        Parameters:
+        key: (tuple) (series fingerprints, indicator name, params)
+        compute: (function) no arguments, returns an array or a tuple of arrays
+
+        Return:
+        read only numpy array, or a tuple of them
+        '''
+
+        if key in self._entries:
+            value, size = self._entries.pop(key)
+            self._entries[key] = (value, size) # most recently used go to the end
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = _freeze(compute())
+        size = _nbytes(value)
+        if size <= self._max_bytes:
+            self._entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+        return value
+
+    def clear(self):
+        '''Drop every indicator and reset the counters'''
+        self._entries.clear()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        '''Counters for the cache
+
+        Return:
+        dict with hits, misses, evictions, entries, bytes and max_bytes
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self._max_bytes}
+
+    def _evict(self):
+        while self._entries and self.bytes > self._max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+
+def _freeze(value):
+    '''Turn the indicator into read only numpy arrays so a strategy can not change a shared copy'''
+    if isinstance(value, (tuple, list)):
+        return tuple(_freeze(v) for v in value)
+    value = np.asarray(value)
+    value.flags.writeable = False
+    return value
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(v.nbytes for v in value)
+    return value.nbytes
+
+
+# The cache used by all backtesters
+shared_cache = IndicatorCache()
@@ -0,0 +1,32 @@
+'''Stand-ins for the plotting and indicator libraries that only import them when first used
+
+A batch worker that never plots never loads matplotlib, seaborn or IPython, and a strategy
+that never calls talib never loads it.
+'''
+
+import importlib
+
+
+class LazyModule(object):
+    '''Imports the named module the first time an attribute is looked up on it'''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'%s>" % (self._name, '' if self._module is None else ' (loaded)')
+
+
+plt = LazyModule('matplotlib.pyplot')
+sns = LazyModule('seaborn')
+talib = LazyModule('talib')
+
+def set_trace(*args, **kwargs):
+    from IPython.core.debugger import set_trace
+    return set_trace(*args, **kwargs)
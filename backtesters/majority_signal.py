@@ -4,10 +4,12 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns, set_trace
 from portfolio import PortfolioBacktester
-from IPython.core.debugger import set_trace
+from columns import Columns
+
+_BLOCK = 64 # voters packed together, a byte of each plane holds 8 of them
+_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float64) # bits of each byte value, first voter on top
 
 
 class MajoritySignalBacktester(PortfolioBacktester):
@@ -18,15 +20,98 @@ class MajoritySignalBacktester(PortfolioBacktester):
     # todo - rather initialise with 1 data series and multiple strategies to combine
     # on that series
 
+    With packed=True the strategies can be any iterable, e.g. a generator building thousands of
+    randomly chosen voters on the same series. Each voter is run as it is read and only its stance
+    is kept, as bits in a long plane and a short plane with a bit per voter (flat is neither, as is
+    a NaN stance). The weighted vote for a bar is then added up a byte at a time from a table of the
+    total weight of each bit pattern, the weighted version of a popcount. 10k voters over ten years
+    of hourly bars take about 220MB.
+
     Parameters:
     strategies: (list) a list of strategies
     weights: (list) optional list of weights, if None then equal weights assumed
+    slippage: (float) slippage on each trade
+    packed: (boolean) keep the voters' stances as bits rather than keeping the strategies
     '''
 
-    def __init__(self, strategies=None, weights=None, slippage=0):
+    def __init__(self, strategies=None, weights=None, slippage=0, packed=False):
         
         self._slippage = slippage
-        super(MajoritySignalBacktester,self).__init__(strategies=strategies, weights=weights)
+        self._packed = packed
+        if not packed:
+            super(MajoritySignalBacktester,self).__init__(strategies=strategies, weights=weights)
+            return
+
+        self._strategies = []
+        self._has_run = False
+        self._drawdowns = {}
+        self._drawdown_highs = {}
+        self._trades = []
+        self._long_only = False
+        self._pack(strategies if strategies is not None else [], weights)
+
+    def _pack(self, voters, weights):
+        '''Run each voter and keep its stance as bits, _BLOCK voters at a time'''
+
+        self._planes = [] # (long, short) bytes for each block, bars x voters / 8
+        count = 0
+        for s in voters:
+            s._run()
+            i = count % _BLOCK
+            if count == 0:
+                index = s._df.index
+                self._df = Columns(index)
+                self._df['last'] = np.array(s._df.array('last'))
+                self._df['market'] = np.array(s._df.array('market'))
+                long = np.zeros((len(index), _BLOCK), dtype=bool)
+                short = np.zeros((len(index), _BLOCK), dtype=bool)
+            elif not s._df.index.equals(index):
+                raise ValueError('Every voter must be on the same series')
+            stance = s._df.array('stance')
+            long[:, i] = stance > 0
+            short[:, i] = stance < 0
+            count += 1
+            if i == _BLOCK - 1:
+                self._planes.append((np.packbits(long, axis=1), np.packbits(short, axis=1)))
+        if count == 0:
+            raise ValueError('Strategy list is empty')
+        if count % _BLOCK:
+            long[:, count % _BLOCK:] = short[:, count % _BLOCK:] = False # left from the block before
+            used = (count % _BLOCK + 7) // 8 # bytes holding the last voters
+            self._planes.append((np.packbits(long, axis=1)[:, :used].copy(), np.packbits(short, axis=1)[:, :used].copy()))
+
+        if weights is None:
+            self._weights = np.ones(count) # whole numbers, so the votes add up exactly
+        else:
+            if len(weights) != count: raise ValueError('Stategy and Weighs mismatch')
+            self._weights = np.asarray(weights, dtype=np.float64)
+        self._start_date = index[0].strftime('%Y-%m-%d')
+        self._end_date = index[-1].strftime('%Y-%m-%d')
+
+    def _votes(self):
+        '''Weighted sum of the voters' stances for each bar, from the packed planes'''
+
+        votes = np.zeros(len(self._df))
+        for b, (long, short) in enumerate(self._planes):
+            weights = np.zeros(long.shape[1] * 8)
+            block = self._weights[b * _BLOCK:(b + 1) * _BLOCK]
+            weights[:len(block)] = block
+            # tables[k][v] is the weight of the voters set in byte value v of byte k
+            tables = _BITS.dot(weights.reshape(-1, 8).T).T.copy()
+            for k in range(long.shape[1]):
+                votes += tables[k].take(long[:, k])
+                votes -= tables[k].take(short[:, k])
+        return votes
+
+    def change_data(self, series):
+        if self._packed:
+            raise ValueError('A packed ensemble only keeps the votes, build a new one for new data')
+        super(MajoritySignalBacktester,self).change_data(series)
+
+    def append(self, bars):
+        if self._packed:
+            raise ValueError('A packed ensemble only keeps the votes, build a new one for new data')
+        super(MajoritySignalBacktester,self).append(bars)
 
     def plot(self, start_date=None, end_date=None, figsize=None, ax=None):
         self._make_sure_has_run()
@@ -45,6 +130,10 @@ class MajoritySignalBacktester(PortfolioBacktester):
         '''Add up all the short long signals
         '''
 
+        if self._packed:
+            self._df['votes'] = self._votes()
+            self._df['stance'] = self._df['votes']
+
         for i, s in enumerate(self._strategies):
             s._run()
             if i==0:
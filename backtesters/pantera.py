@@ -5,8 +5,7 @@ for a long period (1 year)
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from MA import MABacktester
 
 class PanteraBacktester(MABacktester):
@@ -27,6 +26,10 @@ class PanteraBacktester(MABacktester):
             self._ms, self._ml, self._hold, str(self._ema), str(self._start_date), str(self._end_date))
 
 
+    def _warmup(self):
+        '''Each trade holds for a period set when it opens, append() reruns the whole history'''
+        return None
+
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
         a set of stances
@@ -4,21 +4,28 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from backtester import Backtester
-from IPython.core.debugger import set_trace
+from lazy import plt, sns, set_trace
+from backtester import Backtester, _cumsum
+from columns import Columns
 
 
 class PortfolioBacktester(Backtester):
     '''Backtest a combination of strategies
 
+    Every strategy is lined up on one daily calendar once, when the portfolio is set up. Its
+    bars are put in UTC and grouped by day, so strategies in different time zones or with intraday
+    bars combine correctly. Each run fills a days x strategies matrix for the stances, trades and
+    returns and combines them with one matrix-vector product each.
+
     Parameters:
     strategies: (list) a list of strategies
     weights: (list) optional list of weights, if None then equal weights assumed
+    rebalance: (string) None to add up the weighted log returns each day, or how often the weights
+        are reset as a Pandas period e.g. 'W', 'M', 'Q', 'A'. In between each strategy's share of
+        the portfolio drifts with its returns
     '''
 
-    def __init__(self, strategies=None, weights=None):
+    def __init__(self, strategies=None, weights=None, rebalance=None):
         
         if not strategies:
             raise ValueError('Strategy list is empty')
@@ -28,26 +35,41 @@ class PortfolioBacktester(Backtester):
         else:
             if len(weights) != len(strategies): raise ValueError('Stategy and Weighs mismatch')
             if not np.isclose(sum(weights),1): weights = np.array(weights) / float(sum(weights))
-            self._weights = weights
+            self._weights = np.asarray(weights, dtype=np.float64)
 
         self._strategies = strategies
+        self._rebalance = rebalance
         self._has_run = False
+        self._drawdowns = {}
+        self._drawdown_highs = {}
+        self._trades = []
         self._long_only = False;
 
-        # If strategies contain dates with different time zones then this becomes an issue
-        # Setting time zone to none below solves some issues but creates new issues for reindex in _trade_logic()
-        # Need to look into adjusting all strategy dates for time zones before combining them
+        self._make_frame()
 
-        start_dates, end_dates = [],[]
-        for s in self._strategies:
-            start_dates.append(s._df.index[0]) # .replace(tzinfo=None)
-            end_dates.append(s._df.index[-1]) # .replace(tzinfo=None)
+    def _make_frame(self):
+        '''Daily calendar covering every strategy and where each strategy's bars go in it'''
+
+        days = [_days(s._df.index) for s in self._strategies]
+        first = min(d[0] for d in days)
+        last = max(d[-1] for d in days)
+        index = pd.date_range(pd.Timestamp(first), pd.Timestamp(last), freq='d')
 
-        self._start_date = min(start_dates).strftime('%Y-%m-%d')
-        self._end_date = max(end_dates).strftime('%Y-%m-%d')
+        self._start_date = index[0].strftime('%Y-%m-%d')
+        self._end_date = index[-1].strftime('%Y-%m-%d')
+        self._df = Columns(index)
 
-        index = pd.DatetimeIndex(start = self._start_date, end = self._end_date, freq='d')
-        self._df = pd.DataFrame(index=index, columns=['strategy','market','stance','trade']).fillna(0)
+        # for each strategy: the calendar row of each day it has bars, and its first and last bar that day.
+        # Daily bars with no gaps are one slice of the calendar and need no grouping
+        self._alignment = []
+        for d in days:
+            starts = np.flatnonzero(np.concatenate(([True], d[1:] != d[:-1])))
+            rows = (d[starts] - first).astype(np.int64)
+            if len(starts) == len(d) and rows[-1] - rows[0] == len(rows) - 1:
+                self._alignment.append((slice(rows[0], rows[-1] + 1), None, None))
+            else:
+                lasts = np.concatenate((starts[1:], [len(d)])) - 1
+                self._alignment.append((rows, starts, lasts))
 
     def change_data(self, series):
         '''Propogate the new data to all strategies'''
@@ -55,7 +77,25 @@ class PortfolioBacktester(Backtester):
         for s in self._strategies:
             s.change_data(series)
 
+        self._make_frame()
+        self._has_run = False
+        self._drawdowns = {}
+
+    def append(self, bars):
+        '''Propogate the new bars to all strategies, each one only works out its new rows'''
+
+        for s in self._strategies:
+            s.append(bars)
+
+        self._make_frame()
         self._has_run = False
+        self._drawdowns = {}
+
+    def _use_profiler(self, profiler):
+        '''Profile every strategy into the same profiler, so profile() adds them all up'''
+        super(PortfolioBacktester,self)._use_profiler(profiler)
+        for s in self._strategies:
+            s._use_profiler(profiler)
 
     def __str__(self):
         r = ''
@@ -72,13 +112,58 @@ class PortfolioBacktester(Backtester):
         '''Combine the stance from all strategies
         '''
 
+        stance, trade, market, strategy = self._matrices()
+        self._df['stance'] = stance.dot(np.ones(len(self._strategies)))
+        self._df['trade'] = trade.dot(np.ones(len(self._strategies)))
+        self._df['market'] = self._combine(market)
+        self._df['strategy'] = self._combine(strategy)
+
+    def _matrices(self):
+        '''Run each strategy and line it up on the calendar
+
+        Return:
+        days x strategies matrices of the stance at the end of each day, the number of trades
+        and the market and strategy log returns for the day. 0 on days a strategy has no bars
+        '''
+
+        shape = (len(self._df), len(self._strategies))
+        stance, trade, market, strategy = [np.zeros(shape, order='F') for _ in range(4)]
         for i, s in enumerate(self._strategies):
             s._run()
-            self._df['stance'] +=  s._df.reindex(self._df.index, fill_value=0)['stance']
-            self._df['trade'] +=  s._df.reindex(self._df.index, fill_value=0)['trade']
-            self._df['market'] += s._df.reindex(self._df.index, fill_value=0)['market'] * self._weights[i]
-            self._df['strategy'] += s._df.reindex(self._df.index, fill_value=0)['strategy'] * self._weights[i]
+            rows, starts, lasts = self._alignment[i]
+            if starts is None:
+                stance[rows, i] = s._df.array('stance')
+                trade[rows, i] = s._df.array('trade')
+                market[rows, i] = s._df.array('market')
+                strategy[rows, i] = s._df.array('strategy')
+            else:
+                stance[rows, i] = s._df.array('stance')[lasts]
+                trade[rows, i] = np.add.reduceat(s._df.array('trade'), starts)
+                market[rows, i] = np.add.reduceat(s._df.array('market'), starts)
+                strategy[rows, i] = np.add.reduceat(s._df.array('strategy'), starts)
+        return stance, trade, market, strategy
+
+    def _combine(self, returns):
+        '''Log returns of the portfolio from a days x strategies matrix of log returns
+
+        A day with a NaN return in any strategy is NaN, as it was when the returns were added
+        one strategy at a time
+        '''
 
+        if self._rebalance is None:
+            return returns.dot(self._weights)
+
+        # value of each strategy's share since the last rebalance, the portfolio is their sum
+        missing = np.isnan(returns).any(axis=1)
+        growth = np.cumsum(np.where(np.isnan(returns), 0, returns), axis=0)
+        periods = self._df.index.to_period(self._rebalance).asi8
+        starts = np.flatnonzero(np.concatenate(([True], periods[1:] != periods[:-1])))
+        period = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [len(periods)]))))
+        base = np.vstack((np.zeros(returns.shape[1]), growth[starts[1:] - 1]))
+        value = np.log(np.exp(growth - base[period]).dot(self._weights))
+        previous = np.concatenate(([0], value[:-1]))
+        previous[starts] = 0 # the value is reset to 1 at each rebalance
+        return np.where(missing, np.nan, value - previous)
 
     def _run(self):
 
@@ -87,49 +172,37 @@ class PortfolioBacktester(Backtester):
 
         self._trade_logic()
 
-        #set_trace()
-
-        self._df['strategy_last'] = self._df['strategy'].cumsum().apply(np.exp).dropna() # needed for drawdown calculations
+        strategy_returns = self._df.array('strategy')
+        market_returns = self._df.array('market')
+        stance = self._df.array('stance')
+        self._df['strategy_last'] = np.exp(_cumsum(strategy_returns)) # needed for drawdown calculations
+        if 'last' not in self._df: # weighted market index for the market drawdowns
+            self._df['last'] = np.exp(_cumsum(market_returns))
 
         # since we are using log returns multiplying by -1 for shorts works
 
         start_date, end_date = self._df.index[0], self._df.index[-1]
         years = (end_date - start_date).days / 365.25
 
-        #self._df['trade'] = np.where(self._df['stance'] != self._df['stance'].shift(1).fillna(0), 1, 0)
-        trades = self._df['trade'].sum()
-        market = ((np.exp(self._df['market'].cumsum()[-1]) - 1) * 100)
+        trades = self._df.array('trade').sum()
+        market = ((np.exp(_cumsum(market_returns)[-1]) - 1) * 100)
         market_pa = ((market / 100 + 1) ** (1 / years) - 1) * 100
-        strategy = ((np.exp(self._df['strategy'].cumsum()[-1]) - 1) * 100)
+        strategy = ((np.exp(_cumsum(strategy_returns)[-1]) - 1) * 100)
         strategy_pa = ((strategy / 100 + 1) ** (1 / years) - 1) * 100
         
-        #set_trace()
-        
         # Calculating sharpe using log returns
         # For daily data you annualise with sqrt(365.25)
-        sharpe = math.sqrt(365.25) * np.average(self._df['strategy'].dropna()) / np.std(self._df['strategy'].dropna())
-        market_sharpe = math.sqrt(365.25) * np.average(self._df['market'].dropna()) / np.std(self._df['market'].dropna())
+        strategy_returns = strategy_returns[~np.isnan(strategy_returns)]
+        market_returns = market_returns[~np.isnan(market_returns)]
+        sharpe = math.sqrt(365.25) * np.average(strategy_returns) / np.std(strategy_returns)
+        market_sharpe = math.sqrt(365.25) * np.average(market_returns) / np.std(market_returns)
         
-        current_stance = self._df['stance'].iloc[-1]
-
-        # # Current trade unrealised profit or loss
-        # last = self._df['last'].iloc[-1]
-        # if current_stance == 1:
-        #     entry = self._df['buy'].dropna()[-1]
-        #     unrealised = (last / entry - 1) * 100
-        # elif current_stance == -1:
-        #     entry = self._df['sell'].dropna()[-1]
-        #     unrealised = (entry / last - 1) * 100
-        # else:
-        #     unrealised = 0
+        current_stance = stance[-1]
 
         unrealised = np.NAN
 
-        if 0 in self._df.stance.value_counts().index:
-            time_in_market = 1 - float(self._df.stance.value_counts()[0]) / float(self._df.stance.count())
-        else:
-            time_in_market = 1
-
+        stances = stance[~np.isnan(stance)]
+        time_in_market = 1 - float(np.count_nonzero(stances == 0)) / float(len(stances))
         time_in_market = np.round(time_in_market * 100, 2)
 
         self._results = {"Strategy":np.round(strategy,2), "Market":np.round(market,2),"Trades":trades,"Sharpe":np.round(sharpe,2),
@@ -140,3 +213,9 @@ class PortfolioBacktester(Backtester):
 
         self._has_run = True
 
+
+def _days(index):
+    '''Day of each date as numpy days, dates with a time zone are put in UTC first'''
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.values.astype('M8[D]')
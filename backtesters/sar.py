@@ -4,9 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import talib
+from lazy import plt, sns, talib
 from backtester import Backtester
 
 # Using daily close when high and low are not avail or are unreliable
@@ -4,9 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import talib
+from lazy import plt, sns, talib
 from backtester import Backtester
 
 class StochasticBacktester(Backtester):
@@ -64,32 +62,17 @@ class StochasticBacktester(Backtester):
         # buy when below 20 and K crosses over D
         # sell when above 80 and K crossed below D
         
-        current_stance = 0
-        stances = []
+        slowk = self._df['slowk'].values
+        slowd = self._df['slowd'].values
 
-        for index, row in self._df.iterrows():
-            buy_signal = False
-            sell_signal = False
-            if (row['slowd'] < self._buy_on) and (row['slowk'] > row['slowd']):
-                buy_signal = True
-            if (row['slowd'] > self._sell_on) and (row['slowk'] < row['slowd']):
-                sell_signal = True
+        with np.errstate(invalid='ignore'):
+            buy_signal = (slowd < self._buy_on) & (slowk > slowd)
+            sell_signal = (slowd > self._sell_on) & (slowk < slowd)
 
-            if current_stance == 0:
-                if buy_signal:
-                    current_stance = 1
-                if sell_signal and not self._long_only:
-                    current_stance = -1
-            elif current_stance == 1:
-                if sell_signal:
-                    current_stance = 0
-                    if not self._long_only:
-                        current_stance = -1
-            else:
-                if buy_signal: current_stance = 1
-            stances.append(current_stance)
-
-        self._df['stance'] = stances
+        # A sell closes a long and a buy closes a short, both flip straight into the opposite
+        # position unless long only
+        short_signal = None if self._long_only else sell_signal
+        self._df['stance'] = self._stance_machine(buy_signal, short_signal, sell_signal, buy_signal, reverse=True)
 
 
 
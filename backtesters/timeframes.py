@@ -0,0 +1,56 @@
+'''Multi-timeframe index for intraday bars
+
+For each bar the position of the longer period (a day by default) it falls in, the first bar of each
+period and which bars open a period. It is worked out once per series and kept in the shared indicator
+cache, so every intraday strategy on the same bars uses the same one. A daily indicator is then worked
+out on one price per day and turned back into bars with a single gather, rather than resampling the
+bars down to days and the days back up to bars.
+'''
+
+import numpy as np
+import pandas as pd
+from indicator_cache import shared_cache
+
+
+def periods(df, freq='D'):
+    '''Multi-timeframe index of the bars in a column store
+
+    Periods are in the local time of the dates, as with resample()
+
+    Parameters:
+    df: (Columns) column store of a backtester
+    freq: (string) the longer period as a Pandas period e.g. 'D', 'W'
+
+    Return:
+    Tuple of numpy arrays
+    position: the period of each bar, counted from the period of the first bar
+    first: the row of the first bar in each period, -1 for a period with no bars
+    opens: True for the first bar of each period, the close of the period before (e.g. the bar at midnight,
+        or 00:30 for bars stamped on the half hour)
+    '''
+    key = ((df.index_fingerprint(), str(df.index.tz)), 'periods', (freq,))
+    return shared_cache.get(key, lambda: _periods(df.index, freq))
+
+
+def first_of_period(values, first):
+    '''Value at the first bar of each period, NaN for periods with no bars (resample(freq).first())'''
+    return np.where(first >= 0, values[first], np.nan)
+
+
+def to_bars(values, position):
+    '''A value for each period turned back into one for each bar, NaNs are filled from the period before'''
+    values = pd.Series(values).fillna(method='ffill').values
+    return values[position]
+
+
+def _periods(index, freq):
+    if index.tz is not None:
+        index = index.tz_localize(None) # local time
+    ordinals = index.to_period(freq).asi8
+    position = ordinals - ordinals[0]
+
+    opens = np.concatenate(([True], np.diff(position) != 0))
+    starts = np.flatnonzero(opens)
+    first = np.full(position[-1] + 1, -1, dtype=np.int64)
+    first[position[starts]] = starts
+    return position, first, opens
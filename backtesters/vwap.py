@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from backtester import Backtester
 
 class VWAPBacktester(Backtester):
@@ -41,12 +40,19 @@ class VWAPBacktester(Backtester):
         #plt.show()
         return ax
 
+    def _warmup(self):
+        return self._lookback
+
     def _indicators(self):
 
-        self._df['cum_vol'] = self._df['volume'].rolling(window=self._lookback).sum()
-        #self._df['cum_vol_price'] = (self._df['volume'] * (self._df['high'] + self._df['low'] + self._df['last'] ) /3).rolling(window=self._lookback).sum()
-        self._df['cum_vol_price'] = (self._df['volume'] * self._df['last']).rolling(window=self._lookback).sum()
-        self._df['vwap'] = self._df['cum_vol_price'] / self._df['cum_vol']
+        self._df['cum_vol'], self._df['cum_vol_price'], self._df['vwap'] = self._cached('vwap', (self._lookback,),
+            self._vwap, columns=('last', 'volume'))
+
+    def _vwap(self):
+        cum_vol = self._df['volume'].rolling(window=self._lookback).sum()
+        #cum_vol_price = (self._df['volume'] * (self._df['high'] + self._df['low'] + self._df['last'] ) /3).rolling(window=self._lookback).sum()
+        cum_vol_price = (self._df['volume'] * self._df['last']).rolling(window=self._lookback).sum()
+        return cum_vol, cum_vol_price, cum_vol_price / cum_vol
 
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
@@ -0,0 +1,169 @@
+'''Walk forward optimisation of any backtester
+'''
+
+import itertools
+import numpy as np
+import pandas as pd
+from backtester import Backtester
+from batch import map_shared, shared_series
+
+
+class WalkForwardBacktester(Backtester):
+    '''Walk forward optimisation of a backtester over a parameter grid
+
+    The series is split into folds. In each fold every combination in the grid is backtested
+    over the training window and the one with the best metric is traded over the test window
+    that follows. The stances from the test windows are stitched together, so results(), plot(),
+    trades() and drawdowns() are all for the out of sample period only.
+
+    The folds run in parallel. The series is put in shared memory once and every candidate
+    backtests a view of it, nothing is re-sliced into a copy.
+
+    The chosen backtest is run from the start of its training window to the end of the test window
+    so its indicators are warmed up when the test window starts. Only the stances are stitched,
+    so strategies which adjust the market returns themselves (stop losses) are not reproduced exactly.
+
+    Parameters:
+    series: (Panda Series) a list of CLOSE prices by date
+    backtester: (class) the Backtester subclass to optimise, e.g. MABacktester
+    param_grid: (dict) parameter name -> list of values to try, or a list of parameter dicts
+    train: (int) number of bars in each training window
+    test: (int) number of bars in each test window
+    anchored: (boolean) True if every training window starts at the beginning of the series
+    metric: (string) the results() key to maximise over the training window
+    workers: (int) number of processes, defaults to the number of cores
+    params: fixed keyword arguments for every backtest e.g. long_only=True, slippage=0.001
+    '''
+
+    def __init__(self, series, backtester, param_grid, train=365, test=90, anchored=False, metric='Strategy',
+                 workers=None, **params):
+        if series.hasnans:
+            series = series.dropna()
+        if len(series) <= train:
+            raise ValueError('Series is shorter than the training window')
+        if test < 1:
+            raise ValueError('Test window must be at least one bar')
+
+        self._series = series
+        self._backtester = backtester
+        self._grid = _expand(param_grid)
+        self._params = params
+        self._train = train
+        self._test = test
+        self._anchored = anchored
+        self._metric = metric
+        self._workers = workers
+        self._folds = []
+
+        # The bar before the first test window is kept, its stance gives the return of the first test bar
+        super(WalkForwardBacktester,self).__init__(series.iloc[train - 1:], long_only=params.get('long_only', False),
+                                                   slippage=params.get('slippage', 0))
+
+    def __str__(self):
+        return "Walk Forward Backtest (%s, train=%d, test=%d, anchored=%s, metric=%s, start=%s, end=%s)" % (
+            self._backtester.__name__, self._train, self._test, str(self._anchored), self._metric,
+            str(self._start_date), str(self._end_date))
+
+    def change_data(self, series):
+        '''Allow the price data to be changed after the strategy is initialised'''
+        if series.hasnans:
+            series = series.dropna()
+        if len(series) <= self._train:
+            raise ValueError('Series is shorter than the training window')
+        self._series = series
+        self._folds = []
+        super(WalkForwardBacktester,self).change_data(series.iloc[self._train - 1:])
+
+    def append(self, bars):
+        '''Add new bars to the end of the series, the folds are fitted again when next needed'''
+        if isinstance(bars, pd.DataFrame):
+            bars = bars['last']
+        self.change_data(pd.concat([self._series, bars]))
+
+    def windows(self):
+        '''Bar positions of each fold
+
+        Return:
+        list of (train_start, test_start, test_end) with test_end exclusive
+        '''
+        n = len(self._series)
+        windows = []
+        test_start = self._train
+        while test_start < n:
+            train_start = 0 if self._anchored else test_start - self._train
+            test_end = min(test_start + self._test, n)
+            windows.append((train_start, test_start, test_end))
+            test_start = test_end
+        return windows
+
+    def folds(self):
+        '''Table of the parameters chosen in each fold
+
+        Return:
+        DataFrame with one row per fold: the train and test dates, the chosen parameters,
+        the training metric and the strategy and market return (%) over the test window
+        '''
+        self._make_sure_has_run()
+        return pd.DataFrame(self._folds).set_index('Fold')
+
+    def _trade_logic(self):
+        '''Optimise each fold and stitch together the stances of the test windows
+        '''
+
+        windows = self.windows()
+        tasks = [(self._backtester, self._grid, self._params, self._metric, w) for w in windows]
+        fits = map_shared(_fit_fold, tasks, {'series': self._series}, workers=self._workers, chunksize=1)
+
+        offset = self._train - 1 # position in the series of the first bar of _df
+        stance = np.zeros(len(self._df), dtype=np.result_type(*[f[3] for f in fits]))
+        index = self._series.index
+        self._folds = []
+        for i, ((train_start, test_start, test_end), (params, score, returns, stances)) in enumerate(zip(windows, fits)):
+            stance[test_start - 1 - offset:test_end - offset] = stances # later folds take over on their first bar
+            fold = {'Fold': i + 1, 'Train_start': index[train_start], 'Train_end': index[test_start - 1],
+                    'Test_start': index[test_start], 'Test_end': index[test_end - 1]}
+            fold.update(params)
+            fold.update({'Train_' + self._metric.lower(): score,
+                         'Test_strategy': np.round((np.exp(returns[0]) - 1) * 100, 2),
+                         'Test_market': np.round((np.exp(returns[1]) - 1) * 100, 2)})
+            self._folds.append(fold)
+
+        self._df['stance'] = stance
+
+
+def _expand(param_grid):
+    '''Turn a dict of parameter lists into a list of parameter dicts'''
+    if isinstance(param_grid, dict):
+        names = list(param_grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[param_grid[n] for n in names])]
+    return [dict(p) for p in param_grid]
+
+
+def _fit_fold(task):
+    '''Pick the best parameters over the training window and run them through the test window
+
+    Return:
+    (params, training score, (strategy, market) log return over the test window,
+     stances from the bar before the test window to its last bar)
+    '''
+
+    backtester, grid, fixed, metric, (train_start, test_start, test_end) = task
+    series = shared_series('series')
+    train = series.iloc[train_start:test_start]
+
+    best, best_score = grid[0], None
+    for params in grid:
+        kwargs = dict(fixed)
+        kwargs.update(params)
+        score = backtester(train, **kwargs).results()[metric]
+        if best_score is None or score > best_score or (np.isnan(best_score) and not np.isnan(score)):
+            best, best_score = params, score
+
+    kwargs = dict(fixed)
+    kwargs.update(best)
+    chosen = backtester(series.iloc[train_start:test_end], **kwargs)
+    chosen._run()
+    test = slice(test_start - train_start, test_end - train_start)
+    returns = (np.nansum(chosen._df.array('strategy')[test]), np.nansum(chosen._df.array('market')[test]))
+    stances = chosen._df.array('stance')[test_start - 1 - train_start:]
+    return best, best_score, returns, stances
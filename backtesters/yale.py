@@ -4,8 +4,7 @@
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from lazy import plt, sns
 from datetime import timedelta
 from backtester import Backtester
 
@@ -40,57 +39,52 @@ class YaleBacktester(Backtester):
 
     def trades(self):
         '''Return a Pandas DataFrame with details of each trade
-        Needs to override its base class since each trade last 7 days
+        Needs to override its base class since each trade lasts for the hold period
         and buy / sells from different trades will get mixed up
         '''
         self._make_sure_has_run()
-        buy = self._df['buy'].dropna()
-        sell = self._df['sell'].dropna()
-        r = []
-        
-        for date, price in buy.iteritems(): 
-            try:
-                sell_date = date + timedelta(days=7)
-                sell_price = self._df.loc[sell_date,'last']
-            except IndexError: # its the end of the time series
-                sell_price = self._df['last'].iloc[-1] # current price
-                sell_date = self._df['last'].index[-1] # current date
-            finally:
-                days = (sell_date - date).days 
-                r.append((date,"Long",round(price,6),round(sell_price,6),days,sell_price/price-1))   
-
+        buy = self._df['buy'].values
+        last = self._df['last'].values
+        longs = np.flatnonzero(~np.isnan(buy))
 
-        df = pd.DataFrame(sorted(r, key = lambda x: x[0]))
-        df.columns = ['Date','Type','Entry','Exit','Days','Return%']
-        df['Return%'] = np.round(df['Return%'] * 100,2)
-        df.set_index('Date', inplace=True)
+        # each trade is sold at the first bar on or after the end of the hold period
+        exits = self._df.index.searchsorted(self._df.index[longs] + timedelta(days=self._hold))
+        still_open = exits >= len(self._df)
+        exits = np.where(still_open, len(self._df) - 1, exits) # its the end of the time series, use current price
+        ledger = self._trade_ledger(longs, exits, buy[longs], last[exits], 'Long')
 
-        return df
+        return self._trades_frame([ledger])
 
     def _trade_logic(self):
         '''Implements the trade logic in order to come up with
         a set of stances
         '''
         
-        current_stance = 0
-        stances = []
-        count_down = 0
+        # index - lookback wraps round to the end of the series for the first few bars, as with iloc
+        last = self._df['last'].values
+        signal = last / np.roll(last, self._lookback) >= (1+self._threshhold)
+
+        if self._max_positions == 1 and self._hold > 0:
+            stances = self._stance_machine(signal, hold=self._hold)
+        else:
+            # Several positions can be open at once so keep a count down of bars left across all of them
+            current_stance = 0
+            stances = []
+            count_down = 0
+
+            for buy in signal.tolist():
 
-        for index in np.arange(0,len(self._df)):
-            
-            if self._df['last'].iloc[index]/self._df['last'].iloc[index-self._lookback] >= (1+self._threshhold):
-                if current_stance < self._max_positions:
-                    current_stance += 1
-                    count_down += (self._hold + 1)
+                if buy:
+                    if current_stance < self._max_positions:
+                        current_stance += 1
+                        count_down += (self._hold + 1)
 
-            if current_stance > 0 and count_down % (self._hold + 1) == 1:
-                current_stance -= 1
-            
-            if count_down > 0: count_down -= 1
+                if current_stance > 0 and count_down % (self._hold + 1) == 1:
+                    current_stance -= 1
 
-            stances.append(current_stance)
+                if count_down > 0: count_down -= 1
+
+                stances.append(current_stance)
 
         self._df['stance'] = stances
         self._df['stance'] /= self._max_positions
-        
-
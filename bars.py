@@ -0,0 +1,288 @@
+'''Build OHLCV bars from raw trades a chunk at a time and write them into the column store.
+
+Trade files are read in chunks and each chunk is turned into bars with a few numpy passes, so a file
+never has to fit in memory and no resample is run. The bar still open at the end of a chunk is carried
+over to the next one, as is the running volume for volume and dollar bars, so the bars come out the
+same whatever the chunk size (sums of float values such as the turnover behind vwap can differ in the
+last bit, as they are added up in a different order).
+
+    builder = BarBuilder('time', '1h') # or BarBuilder('volume', 1e6), BarBuilder('dollar', 5e7)
+    for trades in read_trades(['trades/20190101.csv.gz', 'trades/20190102.csv.gz'], symbol='XBTUSD'):
+        bars = builder.update(trades)
+    bars = builder.flush() # the last bar
+
+    store = ColumnStore('data/store')
+    trades = read_trades(paths, symbol='XBTUSD', cache='data/trades') # parsed once, then memory mapped
+    write_bars(store, 'XBTUSD_trades_1h', trades, BarBuilder('time', '1h'))
+
+Bars have the columns of the BitMEX bucketed data (open, high, low, close, trades, volume, vwap,
+foreignNotional). Time bars are stamped with the end of the bucket as BitMEX does, so they line up with
+the bars from bitmex_utils, and buckets with no trades are left out. Volume and dollar bars are stamped
+with their last trade.
+'''
+
+import os
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['open', 'high', 'low', 'close', 'trades', 'volume', 'vwap', 'foreignNotional']
+KINDS = ('time', 'volume', 'dollar')
+TRADES = [('timestamp', np.int64), ('price', np.float64), ('size', np.float64), ('foreignNotional', np.float64)]
+
+
+class BarBuilder(object):
+    '''Turns chunks of trades into bars, keeping the unfinished bar between chunks
+
+    A volume (dollar) bar ends with the trade that takes the total volume (value) traded past a
+    multiple of size, and what that trade goes over by counts towards the next bar. So a bar can
+    be a little bigger than size, and a trade bigger than size can close more than one bar's worth
+    at once (the next bar still starts with the trade after it).
+
+    Params
+    ------
+    kind: 'time', 'volume' or 'dollar'
+    size: bar length for time bars e.g. '1m', '1h', '1d' (anything pd.Timedelta takes), contracts for volume
+        bars or value (foreignNotional, price x size if the trades do not have it) for dollar bars
+    '''
+
+    def __init__(self, kind='time', size='1h'):
+        if kind not in KINDS:
+            raise ValueError('Bar kind must be one of %s' % ', '.join(KINDS))
+        self.kind = kind
+        self.size = pd.Timedelta(size).value if kind == 'time' else float(size)
+        if self.size <= 0:
+            raise ValueError('Bar size must be positive')
+        self._open = None # the bar still being built, a dict of one element arrays
+        self._total = 0.0 # volume or value traded so far, for volume and dollar bars
+        self._last = None # stamp of the last bar out, volume and dollar bar stamps are kept unique
+
+    def update(self, trades):
+        '''Add a chunk of trades
+
+        Params
+        ------
+        trades: dataframe with a timestamp column (or a datetime index), price and size, plus
+            foreignNotional if it is known. In time order, and after the trades already added
+
+        Returns
+        -------
+        Dataframe of the bars finished by these trades, the last bar stays open until a later trade
+        (or flush) ends it
+        '''
+
+        stamps = trades['timestamp'] if 'timestamp' in trades.columns else trades.index
+        price = trades['price'].values.astype(np.float64)
+        size = trades['size'].values.astype(np.float64)
+        value = trades['foreignNotional'].values.astype(np.float64) if 'foreignNotional' in trades.columns else price * size
+        return self._update(_utc_nanos(stamps), price, size, value)
+
+    def flush(self):
+        '''Finish the open bar, at the end of the data
+
+        Returns
+        -------
+        Dataframe with the last bar, empty if there is none
+        '''
+        bars, self._open = self._open, None
+        return self._frame(bars)
+
+    def _update(self, stamps, price, size, value):
+        n = len(stamps)
+        if n == 0:
+            return self._frame(None)
+        if self._open is not None and stamps[0] < self._open['last_time'][0]:
+            raise ValueError('Trades must come in time order')
+
+        # the bar each trade goes in, counting from the start of time or of the data
+        if self.kind == 'time':
+            ids = stamps // self.size
+        else:
+            amount = size if self.kind == 'volume' else value
+            total = self._total + np.cumsum(amount)
+            ids = ((total - amount) // self.size).astype(np.int64) # total before the trade
+            self._total = total[-1]
+
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        ends = np.concatenate((starts[1:], [n])) - 1
+        bars = {'id': ids[starts], 'open': price[starts], 'high': np.maximum.reduceat(price, starts),
+                'low': np.minimum.reduceat(price, starts), 'close': price[ends],
+                'trades': np.diff(np.concatenate((starts, [n]))), 'volume': np.add.reduceat(size, starts),
+                'foreignNotional': np.add.reduceat(value, starts), 'turnover': np.add.reduceat(price * size, starts),
+                'last_time': stamps[ends]}
+
+        previous = self._open
+        if previous is not None:
+            if previous['id'][0] == bars['id'][0]: # the first trades finish the bar left open
+                bars['open'][0] = previous['open'][0]
+                bars['high'][0] = max(bars['high'][0], previous['high'][0])
+                bars['low'][0] = min(bars['low'][0], previous['low'][0])
+                for name in ('trades', 'volume', 'foreignNotional', 'turnover'):
+                    bars[name][0] += previous[name][0]
+            else:
+                bars = dict((name, np.concatenate((previous[name], bars[name]))) for name in bars)
+
+        self._open = dict((name, values[-1:].copy()) for name, values in bars.items())
+        return self._frame(dict((name, values[:-1]) for name, values in bars.items()))
+
+    def _frame(self, bars):
+        '''Dataframe of finished bars'''
+        if bars is None or len(bars['id']) == 0:
+            bars = dict((name, np.array([])) for name in COLUMNS + ['id', 'turnover'])
+            bars['id'] = bars['last_time'] = bars['trades'] = np.array([], dtype=np.int64)
+
+        if self.kind == 'time':
+            stamps = (bars['id'] + 1) * self.size # end of the bucket
+        elif len(bars['id']) == 0:
+            stamps = bars['last_time']
+        else:
+            stamps = bars['last_time']
+            if self._last is not None:
+                stamps = np.concatenate(([self._last], stamps))
+            # bars that end on trades with the same stamp are moved on a nanosecond each
+            steps = np.arange(len(stamps))
+            stamps = (np.maximum.accumulate(stamps - steps) + steps)[len(stamps) - len(bars['id']):]
+            self._last = stamps[-1]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = bars['turnover'] / bars['volume']
+        index = pd.DatetimeIndex(stamps.view('M8[ns]')).tz_localize('UTC')
+        return pd.DataFrame(dict((name, vwap if name == 'vwap' else bars[name]) for name in COLUMNS), index=index)
+
+
+def read_trades(paths, symbol=None, chunksize=1000000, cache=None, workers=1):
+    '''Read trade files (BitMEX trade dumps or trades saved from the API) a chunk at a time
+
+    Parsing the CSV is by far the slowest part. With a cache directory each file is parsed once and kept
+    as binaries there, later reads of it (to build other kinds or sizes of bars) memory map them instead
+
+    Params
+    ------
+    paths: a CSV file (gzipped is fine) or a list of them, in time order
+    symbol: only keep the trades of this symbol
+    chunksize: trades read at a time
+    cache: directory for the parsed trades, None to parse the files every time
+    workers: with a cache, the files not parsed yet are parsed this many at a time in separate processes
+
+    Returns
+    -------
+    generator of dataframes with timestamp (UTC), price, size and foreignNotional (price x size if the files
+    do not have it)
+    '''
+
+    if isinstance(paths, str):
+        paths = [paths]
+    if cache is None:
+        for path in paths:
+            for trades in _parse(path, symbol, chunksize):
+                yield _trades_frame(trades)
+        return
+
+    directories = [_cache_path(cache, path, symbol) for path in paths]
+    missing = [(path, directory) for path, directory in zip(paths, directories) if not os.path.isdir(directory)]
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(_save, *zip(*[(path, directory, symbol, chunksize) for path, directory in missing])))
+    else:
+        for path, directory in missing:
+            _save(path, directory, symbol, chunksize)
+
+    for directory in directories:
+        arrays = dict((name, np.memmap(os.path.join(directory, name + '.bin'), dtype=dtype, mode='r'))
+                      for name, dtype in TRADES if os.path.getsize(os.path.join(directory, name + '.bin')))
+        for start in range(0, len(arrays.get('timestamp', [])), chunksize):
+            yield _trades_frame(dict((name, values[start:start + chunksize]) for name, values in arrays.items()))
+
+
+def write_bars(store, name, trades, builder, final=True):
+    '''Build bars from chunks of trades and append them to a dataset of the store as they are finished
+
+    Params
+    ------
+    store: ColumnStore
+    name: dataset name e.g. 'XBTUSD_trades_1h'
+    trades: iterable of trade dataframes, e.g. from read_trades()
+    builder: BarBuilder, keep it to carry on with the next trades later
+    final: also write the open bar at the end. Leave it False when more trades for that bar are to come,
+        the store only appends after its last bar so the rest of that bar could not be added later
+
+    Returns
+    -------
+    Number of bars written
+    '''
+
+    rows = 0
+    for chunk in trades:
+        bars = builder.update(chunk)
+        if len(bars):
+            rows += store.append(name, bars)
+    if final:
+        bars = builder.flush()
+        if len(bars):
+            rows += store.append(name, bars)
+    return rows
+
+
+def _parse(path, symbol, chunksize):
+    '''Chunks of a trade file as dicts of the TRADES arrays'''
+    wanted = ('symbol',) + tuple(name for name, _ in TRADES)
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=lambda c: c in wanted):
+        if symbol is not None and 'symbol' in chunk.columns:
+            chunk = chunk[chunk['symbol'].values == symbol]
+        price, size = chunk['price'].values.astype(np.float64), chunk['size'].values.astype(np.float64)
+        yield {'timestamp': _parse_times(chunk['timestamp'].values).view(np.int64), 'price': price, 'size': size,
+               'foreignNotional': chunk['foreignNotional'].values.astype(np.float64)
+                                  if 'foreignNotional' in chunk.columns else price * size}
+
+
+def _save(path, directory, symbol, chunksize):
+    '''Parse a trade file into the cache, written to a temporary directory and then renamed'''
+    temp = directory + '.tmp'
+    shutil.rmtree(temp, ignore_errors=True)
+    os.makedirs(temp)
+    files = dict((name, open(os.path.join(temp, name + '.bin'), 'wb')) for name, _ in TRADES)
+    try:
+        for trades in _parse(path, symbol, chunksize):
+            for name, dtype in TRADES:
+                files[name].write(np.ascontiguousarray(trades[name], dtype=dtype).tobytes())
+    finally:
+        for f in files.values():
+            f.close()
+    os.rename(temp, directory)
+
+
+def _cache_path(cache, path, symbol):
+    '''Cache directory of a trade file, a new one if the file changes'''
+    info = os.stat(path)
+    key = hashlib.sha1(('%s:%d:%d:%s' % (os.path.abspath(path), info.st_size, info.st_mtime_ns, symbol)).encode())
+    return os.path.join(cache, '%s-%s-%s' % (os.path.basename(path).split('.')[0], symbol, key.hexdigest()[:16]))
+
+
+def _trades_frame(trades):
+    frame = pd.DataFrame(dict((name, trades[name]) for name, _ in TRADES[1:]))
+    frame.insert(0, 'timestamp', pd.DatetimeIndex(np.asarray(trades['timestamp']).view('M8[ns]')).tz_localize('UTC'))
+    return frame
+
+
+def _parse_times(values):
+    '''UTC datetimes from ISO strings, with BitMEX's 2019-01-01D00:00:00.000000000 and a trailing Z allowed
+
+    The strings are changed as fixed width bytes, which is a lot quicker than pandas string methods
+    '''
+    chars = np.asarray(values).astype('S')
+    width = chars.dtype.itemsize
+    chars = chars.view('S1').reshape(len(chars), width).copy()
+    if width > 10:
+        chars[:, 10] = b'T'
+    chars[chars == b'Z'] = b''
+    return chars.view('S%d' % width).ravel().astype('M8[ns]')
+
+
+def _utc_nanos(stamps):
+    '''Nanoseconds since 1970 UTC, naive dates are taken to be UTC'''
+    stamps = pd.DatetimeIndex(stamps)
+    if stamps.tz is not None:
+        stamps = stamps.tz_convert('UTC').tz_localize(None)
+    return stamps.values.astype('M8[ns]').view(np.int64)
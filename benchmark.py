@@ -0,0 +1,323 @@
+'''Benchmarks and golden output checks for the backtesters.
+
+    python benchmark.py run --sizes 1e3 1e4 1e5 1e6   # time every strategy, add the timings to the history
+    python benchmark.py compare                       # latest run against the one before, flag slow downs
+    python benchmark.py golden                        # check outputs against benchmarks/golden.json
+    python benchmark.py golden --update               # record new golden outputs (only after checking them!)
+
+Every strategy runs on the same synthetic prices (a random walk with high, low and volume), timed per phase:
+trade_logic, market_returns, stats (the rest of _run), trades, drawdowns and heatmap (the monthly and yearly
+aggregation behind plot_heatmap). The golden check hashes the stances, returns, trades and drawdowns and keeps
+the results() values, so an optimised path has to reproduce the reference bit for bit. A strategy that
+raises fails the check, and a run, and its error is never recorded as a golden output or a timing.
+'''
+
+import os
+import sys
+import json
+import time
+import hashlib
+import importlib
+import platform
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+import backtesters
+
+HISTORY = os.path.join(ROOT, 'benchmarks', 'history.json')
+GOLDEN = os.path.join(ROOT, 'benchmarks', 'golden.json')
+PHASES = ['trade_logic', 'market_returns', 'stats', 'trades', 'drawdowns', 'heatmap']
+
+# name -> (class, function of the synthetic data giving (args, kwargs), most bars it is run on)
+STRATEGIES = {
+    'buy_and_hold': ('backtester.Backtester', lambda d: ((d['last'],), {}), None),
+    'ma': ('MABacktester', lambda d: ((d['last'],), {'ms': 5, 'ml': 50, 'slippage': 0.001}), None),
+    'ma_ema': ('MABacktester', lambda d: ((d['last'],), {'ms': 5, 'ml': 50, 'ema': True}), None),
+    'ma_long_only': ('MABacktester', lambda d: ((d['last'],), {'ms': 1, 'ml': 20, 'long_only': True}), None),
+    'ma_delay': ('MADelayBacktester', lambda d: ((d['last'],), {'ms': 5, 'ml': 50}), None),
+    'ma_short_only': ('MAShortOnlyBacktester', lambda d: ((d['last'],), {'ms': 5, 'ml': 50}), None),
+    'ma_assymetric': ('MAAssymetricBacktester', lambda d: ((d['last'],), {}), None),
+    'ma_stop_loss': ('MAStopLossBacktester', lambda d: ((d['last'], d['high'], d['low']), {'ms': 1, 'ml': 5}), None),
+    'ma_stop_loss2': ('MAStopLossBacktester2', lambda d: ((d['last'], d['high'], d['low']), {'ms': 1, 'ml': 5}), None),
+    'ma_live_optimise': ('MALiveOptimiseBacktester', lambda d: ((d['last'],), {}), 300),
+    'impulse': ('impulse.MABacktester', lambda d: ((d['last'],), {'ms': 5, 'ml': 50}), None),
+    'triple_ma': ('TripleMABacktester', lambda d: ((d['last'],), {}), None),
+    'pantera': ('PanteraBacktester', lambda d: ((d['last'],), {}), None),
+    'rsi': ('RSIBacktester', lambda d: ((d['last'],), {}), None),
+    'macd': ('MACDBacktester', lambda d: ((d['last'],), {}), None),
+    'williams': ('WilliamsRBacktester', lambda d: ((d['last'],), {}), None),
+    'stochastic': ('StochasticBacktester', lambda d: ((d['last'], d['high'], d['low']), {}), None),
+    'sar': ('SARBacktester', lambda d: ((d['last'], d['high'], d['low']), {}), None),
+    'donchian': ('DonchianBacktester', lambda d: ((d['last'],), {}), None),
+    'bollinger_mr': ('BollingerMR', lambda d: ((d['last'],), {'trend': 100}), None),
+    'bollinger_momentum': ('BollingerMomentum', lambda d: ((d['last'],), {}), None),
+    'atr': ('ATRMomentum', lambda d: ((d['last'], d['high'], d['low']), {}), None),
+    'vwap': ('VWAPBacktester', lambda d: ((d['last'], d['volume']), {}), None),
+    'higher': ('HigherPriceBacktester', lambda d: ((d['last'],), {}), None),
+    'new_high': ('NewHighBacktester', lambda d: ((d['last'],), {}), None),
+    'buy_if_up': ('BuyIfUpBacktester', lambda d: ((d['last'],), {}), None),
+    'yale': ('YaleBacktester', lambda d: ((d['last'],), {}), None),
+    'google': ('GoogleBacktester', lambda d: ((d['last'], d['volume']), {}), None),
+    'portfolio': ('PortfolioBacktester', lambda d: ((), {'strategies': [backtesters.MABacktester(d['last'], ms=5, ml=50),
+                                                                       backtesters.DonchianBacktester(d['last'])]}), None),
+    'majority_signal': ('MajoritySignalBacktester', lambda d: ((), {'strategies': [
+        backtesters.MABacktester(d['last'], ms=1, ml=n) for n in (10, 20, 50)]}), None),
+}
+
+
+def synthetic(n, freq=None, seed=0):
+    '''Random walk prices with high, low and volume, n bars from 2000-01-01
+
+    Bars are hourly, or a minute apart above a million bars to stay inside the dates pandas can hold
+
+    Returns
+    -------
+    dict of series: last, high, low, volume
+    '''
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2000-01-01', periods=n, freq=freq or ('h' if n <= 1e6 else 'min'))
+    last = 100 * np.exp(np.cumsum(rng.normal(0.00002, 0.002, n)))
+    spread = np.abs(rng.normal(0, 0.001, n))
+    return {'last': pd.Series(last, index=index), 'high': pd.Series(last * (1 + spread), index=index),
+            'low': pd.Series(last * (1 - spread), index=index),
+            'volume': pd.Series(rng.randint(1, 1000, n).astype(float), index=index)}
+
+
+def make(name, data):
+    '''Build a strategy on the synthetic data, trimmed to the most bars it is run on'''
+    path, build, most = STRATEGIES[name]
+    if most is not None:
+        data = dict((k, v.iloc[:most]) for k, v in data.items())
+    if '.' in path: # a class the package does not export, from its module
+        module, cls = path.rsplit('.', 1)
+        target = getattr(importlib.import_module(module), cls)
+    else:
+        target = getattr(backtesters, path)
+    args, kwargs = build(data)
+    return target(*args, **kwargs)
+
+
+def time_phases(bt):
+    '''Seconds spent in each phase of one backtest, from the backtester's own profile()'''
+    bt.set_profiling()
+    bt._run()
+    bt.trades()
+    bt.drawdowns(cutoff=0)
+    profile = bt.profile()
+    timings = dict((phase, profile[phase.capitalize()]) for phase in PHASES if phase != 'heatmap')
+
+    start = time.perf_counter()
+    _heatmap(bt)
+    timings['heatmap'] = time.perf_counter() - start
+    return timings
+
+
+def _heatmap(bt):
+    '''The aggregation plot_heatmap does, without drawing'''
+    returns = bt._df['strategy']
+    return (bt._sum_returns(returns, [returns.index.year, returns.index.month]),
+            bt._sum_returns(returns, returns.index.year))
+
+
+def run(sizes, names=None, repeat=1, seed=0, history=HISTORY):
+    '''Time every strategy at every size and add the run to the history
+
+    Returns
+    -------
+    (run, failed) where run is a dict with the environment and timings[strategy][bars][phase] in seconds
+    (the best of repeat runs) and failed a dict of strategy -> error for the strategies that raised, they
+    are left out of the run
+    '''
+    names = names or sorted(STRATEGIES)
+    timings = dict((name, {}) for name in names)
+    failed = {}
+    for n in sizes:
+        n = int(n)
+        data = synthetic(n, seed=seed)
+        for name in names:
+            most = STRATEGIES[name][2]
+            if name in failed or (most is not None and n > most and str(most) in timings[name]):
+                continue
+            best = None
+            try:
+                for _ in range(repeat):
+                    backtesters.shared_cache.clear() # every repeat starts cold
+                    t = time_phases(make(name, data))
+                    best = t if best is None else dict((p, min(best[p], t[p])) for p in PHASES)
+            except Exception as e:
+                failed[name] = repr(e)
+                print('%-20s %10d bars FAILED %r' % (name, n, e))
+                continue
+            bars = min(n, most) if most is not None else n
+            best['total'] = sum(best[p] for p in PHASES)
+            best['bars_per_second'] = bars / best['total'] if best['total'] else None
+            timings[name][str(bars)] = best
+            print('%-20s %10d bars %8.3fs' % (name, bars, best['total']))
+
+    record = {'date': pd.Timestamp.now().isoformat(), 'commit': _commit(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(),
+              'processor': platform.processor(), 'repeat': repeat, 'timings': timings}
+    if history:
+        runs = _load(history, [])
+        runs.append(record)
+        _save(history, runs)
+    return record, failed
+
+
+def compare(history=HISTORY, threshold=0.1):
+    '''Latest run against the run before it
+
+    Returns
+    -------
+    DataFrame of strategy, bars and phase with both timings and the ratio, slow downs over threshold flagged
+    '''
+    runs = _load(history, [])
+    if len(runs) < 2:
+        raise ValueError('Need two runs in %s to compare' % history)
+    before, after = runs[-2]['timings'], runs[-1]['timings']
+    rows = []
+    for name in sorted(set(before) & set(after)):
+        for bars in sorted(set(before[name]) & set(after[name]), key=int):
+            for phase in PHASES + ['total']:
+                old, new = before[name][bars].get(phase), after[name][bars].get(phase)
+                if old is None or new is None:
+                    continue
+                ratio = new / old if old else np.nan
+                rows.append({'Strategy': name, 'Bars': int(bars), 'Phase': phase, 'Before': old, 'After': new,
+                             'Ratio': ratio, 'Slower': ratio > 1 + threshold})
+    return pd.DataFrame(rows, columns=['Strategy', 'Bars', 'Phase', 'Before', 'After', 'Ratio', 'Slower'])
+
+
+def outputs(name, n=3000, seed=42):
+    '''Everything a strategy produces on fixed synthetic data, with the arrays hashed'''
+    backtesters.shared_cache.clear()
+    bt = make(name, synthetic(n, seed=seed))
+    results = dict((k, _plain(v)) for k, v in bt.results().items())
+    arrays = dict((c, _digest(bt._df[c].values.astype(np.float64)))
+                  for c in ['stance', 'market', 'strategy', 'strategy_last', 'buy', 'sell', 'trade'] if c in bt._df)
+    trades = bt.trades() if 'buy' in bt._df else [] # a portfolio has no trades of its own
+    return {'results': results, 'arrays': arrays,
+            'trades': _digest(pd.util.hash_pandas_object(trades).values) if len(trades) else None,
+            'drawdowns': dict((target, _digest(pd.util.hash_pandas_object(bt.drawdowns(target, cutoff=0)).values))
+                              for target in ('strategy', 'market'))}
+
+
+def golden(names=None, path=GOLDEN, update=False):
+    '''Check (or with update record) the outputs of every strategy against the golden file
+
+    A strategy that raises is a failure, with update its golden output is left as it was
+
+    Returns
+    -------
+    dict of strategy -> list of the things that differ, empty when it matches
+    '''
+    names = names or sorted(STRATEGIES)
+    reference = _load(path, {})
+    differences = {}
+    for name in names:
+        try:
+            found = outputs(name)
+        except Exception as e:
+            differences[name] = ['raised %r' % e]
+            continue
+        if update:
+            reference[name] = found
+            continue
+        expected = reference.get(name)
+        if expected is None:
+            differences[name] = ['no golden output']
+            continue
+        differences[name] = _differences(expected, found)
+    if update:
+        _save(path, dict((name, found) for name, found in reference.items() if name in STRATEGIES))
+    return differences
+
+
+def _differences(expected, found, prefix=''):
+    if isinstance(expected, dict) and isinstance(found, dict):
+        out = []
+        for key in sorted(set(expected) | set(found)):
+            out += _differences(expected.get(key), found.get(key), prefix + key + '.')
+        return out
+    same = expected == found or (isinstance(expected, float) and isinstance(found, float)
+                                 and np.isnan(expected) and np.isnan(found))
+    return [] if same else ['%s %r != %r' % (prefix.rstrip('.'), expected, found)]
+
+
+def _digest(values):
+    return hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+def _plain(value):
+    '''JSON friendly value, floats kept exactly'''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+        return str(value)
+    return value
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _load(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def _save(path, value):
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks and golden output checks for the backtesters')
+    commands = parser.add_subparsers(dest='command')
+    p = commands.add_parser('run', help='time every strategy and add the timings to the history')
+    p.add_argument('--sizes', nargs='+', type=float, default=[1e3, 1e4, 1e5, 1e6])
+    p.add_argument('--strategies', nargs='+')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--history', default=HISTORY)
+    p = commands.add_parser('compare', help='latest run against the one before')
+    p.add_argument('--history', default=HISTORY)
+    p.add_argument('--threshold', type=float, default=0.1)
+    p = commands.add_parser('golden', help='check the outputs against the golden file')
+    p.add_argument('--strategies', nargs='+')
+    p.add_argument('--file', default=GOLDEN)
+    p.add_argument('--update', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        _, failed = run(args.sizes, args.strategies, repeat=args.repeat, history=args.history)
+        return 1 if failed else 0
+    elif args.command == 'compare':
+        table = compare(args.history, args.threshold)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(table)
+        return 1 if table['Slower'].any() else 0
+    elif args.command == 'golden':
+        differences = golden(args.strategies, args.file, args.update)
+        failed = dict((name, d) for name, d in differences.items() if d)
+        for name in sorted(differences):
+            print('%-20s %s' % (name, 'ok' if not differences[name] else 'DIFFERS'))
+            for d in differences[name][:10]:
+                print('    ' + d)
+        return 1 if failed else 0
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+'''Append-only columnar store for price data, read back through memory maps.
+
+Each dataset is a directory with a raw binary file per column and one for the index (UTC nanoseconds).
+Rows only ever go on the end, so an append writes the new rows and nothing else. A table of the first
+row of every month (the partitions) narrows a date range down to a few pages of the index before the
+binary search, and because every column is one contiguous file a range read is a slice of a memory map,
+nothing is copied.
+
+    store = ColumnStore('data/store')
+    store.append('XBTUSD_1h', ohlc)
+    ohlc = store.read('XBTUSD_1h', start='2018-01-01')
+    close = store.series('XBTUSD_1h', 'close') # memory mapped, hand it straight to a backtester
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+INDEX = '_index'
+
+
+class ColumnStore(object):
+    '''Directory of append-only datasets
+
+    Params
+    ------
+    root: directory holding the datasets, created if needed
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def datasets(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.exists(os.path.join(self.root, d, 'meta.json')))
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name, 'meta.json'))
+
+    def append(self, name, frame):
+        '''Add rows to the end of a dataset, creating it if needed
+
+        Params
+        ------
+        name: dataset name e.g. 'XBTUSD_1h'
+        frame: dataframe with a datetime index. Numeric and boolean columns are stored, the first append
+            fixes the columns and their types, later frames must have all of them. Rows at or before the
+            last stored date are skipped so a refresh can be repeated safely
+
+        Returns
+        -------
+        Number of rows added
+        '''
+
+        frame = frame.sort_index()
+        index = pd.DatetimeIndex(frame.index)
+        if name not in self:
+            columns = [c for c in frame.columns if frame[c].dtype.kind in 'biuf']
+            if not columns:
+                raise ValueError('Nothing to store, %s has no numeric columns' % name)
+            os.makedirs(self._path(name))
+            meta = {'columns': columns, 'dtypes': [frame[c].dtype.str for c in columns],
+                    'tz': str(index.tz) if index.tz is not None else None, 'rows': 0, 'partitions': []}
+            for column in [INDEX] + columns:
+                open(self._path(name, column + '.bin'), 'wb').close()
+        else:
+            meta = self._meta(name)
+
+        stamps = _utc_nanos(index)
+        rows = self._rows(name, meta)
+        if rows:
+            last = np.memmap(self._path(name, INDEX + '.bin'), dtype=np.int64, mode='r', offset=(rows - 1) * 8)[0]
+            new = stamps > last
+            frame, stamps = frame[new], stamps[new]
+        if len(stamps) == 0:
+            return 0
+        missing = [c for c in meta['columns'] if c not in frame.columns]
+        if missing:
+            raise ValueError('Frame is missing %s' % ', '.join(missing))
+        if len(np.unique(stamps)) != len(stamps):
+            raise ValueError('Dates must be unique')
+
+        # the columns go first and the index last, a crash part way leaves rows the index does not count yet
+        for column, dtype in zip(meta['columns'], meta['dtypes']):
+            self._write(name, column, rows, np.asarray(frame[column].values, dtype=np.dtype(dtype)))
+        self._write(name, INDEX, rows, stamps)
+
+        meta['partitions'].extend(_partitions(stamps, rows, meta['partitions']))
+        meta['rows'] = rows + len(stamps)
+        self._save_meta(name, meta)
+        return len(stamps)
+
+    def read(self, name, start=None, end=None, columns=None):
+        '''Rows between two dates (inclusive) as a dataframe
+
+        The columns are memory mapped and only the pages in the range are read from disk
+        '''
+        index, arrays = self.arrays(name, start, end, columns)
+        return pd.DataFrame(arrays, index=index, columns=list(arrays.keys()))
+
+    def series(self, name, column='close', start=None, end=None):
+        '''One column as a series backed by the memory map, no copy is made'''
+        index, arrays = self.arrays(name, start, end, [column])
+        return pd.Series(arrays[column], index=index, name=column, copy=False)
+
+    def arrays(self, name, start=None, end=None, columns=None):
+        '''Read only memory mapped arrays for the rows between two dates (inclusive)
+
+        Returns
+        -------
+        (index, dict of column -> array) with the index a DatetimeIndex
+        '''
+
+        meta = self._meta(name)
+        rows = self._rows(name, meta)
+        columns = meta['columns'] if columns is None else list(columns)
+        for column in columns:
+            if column not in meta['columns']:
+                raise KeyError(column)
+        if rows == 0:
+            return pd.DatetimeIndex([], tz=meta['tz']), dict((c, np.array([])) for c in columns)
+
+        stamps = np.memmap(self._path(name, INDEX + '.bin'), dtype=np.int64, mode='r', shape=(rows,))
+        first, last = 0, rows
+        if start is not None:
+            first = self._locate(stamps, meta, _utc_nanos(pd.DatetimeIndex([start], tz=_tz(start, meta)))[0], 'left')
+        if end is not None:
+            last = self._locate(stamps, meta, _utc_nanos(pd.DatetimeIndex([end], tz=_tz(end, meta)))[0], 'right')
+        last = max(first, last)
+
+        index = pd.DatetimeIndex(np.asarray(stamps[first:last]).view('M8[ns]'))
+        if meta['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['tz'])
+        dtypes = dict(zip(meta['columns'], meta['dtypes']))
+        arrays = {}
+        for column in columns:
+            values = np.memmap(self._path(name, column + '.bin'), dtype=np.dtype(dtypes[column]), mode='r', shape=(rows,))
+            arrays[column] = values[first:last]
+        return index, arrays
+
+    def last_date(self, name):
+        '''Date of the last row, None if the dataset is empty or missing'''
+        if name not in self:
+            return None
+        meta = self._meta(name)
+        rows = self._rows(name, meta)
+        if rows == 0:
+            return None
+        index, _ = self.arrays(name, columns=[])
+        return index[-1]
+
+    def __len__(self):
+        return len(self.datasets())
+
+    def _locate(self, stamps, meta, stamp, side):
+        '''Row of a date, the partition table picks the month so only its rows are searched'''
+        partitions = meta['partitions']
+        starts = [p[1] for p in partitions]
+        month = _month(np.array([stamp]))[0]
+        k = np.searchsorted([p[0] for p in partitions], month, side='right') - 1
+        if k < 0:
+            return 0
+        lo = starts[k]
+        hi = starts[k + 1] if k + 1 < len(starts) else len(stamps)
+        return lo + int(np.searchsorted(stamps[lo:hi], stamp, side=side))
+
+    def _rows(self, name, meta):
+        '''Rows written in full, a crash after writing the index but before the meta data is picked up here'''
+        rows = os.path.getsize(self._path(name, INDEX + '.bin')) // 8
+        if rows > meta['rows']:
+            stamps = np.memmap(self._path(name, INDEX + '.bin'), dtype=np.int64, mode='r', shape=(rows,))
+            meta['partitions'].extend(_partitions(np.asarray(stamps[meta['rows']:]), meta['rows'], meta['partitions']))
+            meta['rows'] = rows
+        return meta['rows']
+
+    def _write(self, name, column, rows, values):
+        with open(self._path(name, column + '.bin'), 'r+b') as f:
+            f.seek(rows * values.dtype.itemsize) # drops anything left over from a crashed append
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.truncate()
+
+    def _meta(self, name):
+        with open(self._path(name, 'meta.json')) as f:
+            return json.load(f)
+
+    def _save_meta(self, name, meta):
+        path = self._path(name, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def _path(self, name, *parts):
+        return os.path.join(self.root, name, *parts)
+
+
+def _utc_nanos(index):
+    '''Nanoseconds since 1970 UTC for each date'''
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.values.astype('M8[ns]').view(np.int64)
+
+def _tz(date, meta):
+    '''Time zone to read a start / end date in, naive dates are taken to be in the dataset's time zone'''
+    return None if getattr(pd.Timestamp(date), 'tz', None) is not None else meta['tz']
+
+def _month(stamps):
+    '''Months since 1970 for each date, the partition key'''
+    return stamps.view('M8[ns]').astype('M8[M]').astype(np.int64)
+
+def _partitions(stamps, offset, partitions):
+    '''[month, first row] for each month that starts in stamps'''
+    months = _month(stamps)
+    new = np.flatnonzero(np.concatenate([[True], months[1:] != months[:-1]]))
+    if partitions and months[0] == partitions[-1][0]:
+        new = new[1:]
+    return [[int(months[i]), int(offset + i)] for i in new]
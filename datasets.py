@@ -0,0 +1,165 @@
+'''Registry of the CSV price sources in the repo, cleaned once and cached as memory mapped binaries.
+
+Each source has a recipe that turns the raw CSV into a clean frame (the same cleanup the notebooks
+do by hand). The first load runs the recipe and saves the frame as numpy files in a cache directory
+keyed by the hash of the CSV, later loads memory map those files so nothing is parsed or copied.
+Editing the CSV (or bumping the recipe version) gives a new key and the cache is rebuilt.
+
+    import datasets
+    sp500 = datasets.load('sp500')
+    nasdaq = datasets.series('nasdaq') # Close
+    returns = datasets.log_returns('hashrate')
+
+Every column is stored as float64 in one matrix, so a frame is a view of the file.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_csv(path):
+    '''Dates in the first column, a byte order mark (btc_hash_rate.csv has one) is skipped'''
+    return pd.read_csv(path, index_col=0, parse_dates=[0], encoding='utf-8-sig')
+
+def close_fix(df):
+    '''Data sets that stamp each day with its open, shift so each date has its close'''
+    return df.shift(-1).iloc[:-1]
+
+def drop_zeros(df):
+    '''Drop the rows before the first date with no zero prices'''
+    nonzero = np.flatnonzero((df.values != 0).all(axis=1))
+    return df.iloc[nonzero[0]:] if len(nonzero) else df.iloc[:0]
+
+def _nasdaq(df):
+    '''FRED marks holidays with a '.', treat them as missing and carry the last close forward'''
+    df.columns = ['Close']
+    df.index.name = 'Date'
+    df['Close'] = pd.to_numeric(df['Close'], errors='coerce')
+    return df.fillna(method='ffill')
+
+
+class Registry(object):
+    '''Named CSV sources with their cleaning recipes and a memory mapped cache
+
+    Params
+    ------
+    cache: directory for the cached binaries, defaults to .dataset_cache next to this file
+    '''
+
+    def __init__(self, cache=None):
+        self.cache = cache or os.path.join(ROOT, '.dataset_cache')
+        self._sources = OrderedDict()
+        self._loaded = {}
+
+    def register(self, name, path, recipe=None, column='Close', version=1):
+        '''Add a source
+
+        Params
+        ------
+        name: name to load it by
+        path: CSV file, relative paths are from the repo root
+        recipe: function taking the raw frame from read_csv and returning the clean one, None to use it as is
+        column: default column for series() and log_returns()
+        version: change it when the recipe changes so cached copies are rebuilt
+        '''
+        self._sources[name] = {'path': path if os.path.isabs(path) else os.path.join(ROOT, path),
+                               'recipe': recipe, 'column': column, 'version': version}
+        self._loaded.pop(name, None)
+
+    def names(self):
+        return list(self._sources.keys())
+
+    def load(self, name):
+        '''Clean frame of a source, memory mapped from the cache'''
+        matrix, index, columns, _ = self._open(name)
+        return pd.DataFrame(matrix.T, index=index, columns=columns, copy=False)
+
+    def series(self, name, column=None):
+        '''One column of a source as a series, a view of the memory map'''
+        matrix, index, columns, _ = self._open(name)
+        column = column or self._sources[name]['column']
+        return pd.Series(matrix[columns.index(column)], index=index, name=column, copy=False)
+
+    def log_returns(self, name, column=None):
+        '''Log returns of one column, worked out when the cache was built'''
+        _, index, columns, returns = self._open(name)
+        column = column or self._sources[name]['column']
+        return pd.Series(returns[columns.index(column)], index=index, name=column, copy=False)
+
+    def clear(self, name=None):
+        '''Delete the cached binaries of one source, or of all of them'''
+        for key in (self._keys(name) if name else os.listdir(self.cache) if os.path.isdir(self.cache) else []):
+            shutil.rmtree(os.path.join(self.cache, key), ignore_errors=True)
+        self._loaded = {} if name is None else dict((k, v) for k, v in self._loaded.items() if k != name)
+
+    def _open(self, name):
+        '''(matrix, index, columns, log returns) for a source, building its cache if it is missing or stale'''
+        source = self._sources[name]
+        key = '%s-%s' % (name, self._hash(source))
+        if self._loaded.get(name, (None,))[0] == key:
+            return self._loaded[name][1]
+
+        path = os.path.join(self.cache, key)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            self._build(name, source, path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        index = pd.DatetimeIndex(np.load(os.path.join(path, 'index.npy'), mmap_mode='r'), name=meta['index'])
+        opened = (np.load(os.path.join(path, 'values.npy'), mmap_mode='r'), index, meta['columns'],
+                  np.load(os.path.join(path, 'log_returns.npy'), mmap_mode='r'))
+        self._loaded[name] = (key, opened)
+        return opened
+
+    def _build(self, name, source, path):
+        '''Run the recipe and save the clean frame, written to a temporary directory and then renamed'''
+        df = read_csv(source['path'])
+        if source['recipe'] is not None:
+            df = source['recipe'](df)
+        df = df.sort_index()
+
+        values = np.ascontiguousarray(df.values.astype(np.float64).T) # (columns, dates), each column is contiguous
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.full(values.shape, np.nan)
+            returns[:, 1:] = np.log(values[:, 1:] / values[:, :-1])
+
+        for old in self._keys(name):
+            shutil.rmtree(os.path.join(self.cache, old), ignore_errors=True)
+        temp = path + '.tmp'
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        np.save(os.path.join(temp, 'index.npy'), df.index.values.astype('M8[ns]'))
+        np.save(os.path.join(temp, 'values.npy'), values)
+        np.save(os.path.join(temp, 'log_returns.npy'), returns)
+        with open(os.path.join(temp, 'meta.json'), 'w') as f:
+            json.dump({'columns': [str(c) for c in df.columns], 'index': df.index.name, 'source': source['path']}, f)
+        os.rename(temp, path)
+
+    def _hash(self, source):
+        h = hashlib.sha1(('%s:%d:' % (getattr(source['recipe'], '__name__', None), source['version'])).encode())
+        with open(source['path'], 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest()[:16]
+
+    def _keys(self, name):
+        '''Cache directories of a source, whatever their hash'''
+        if not os.path.isdir(self.cache):
+            return []
+        return [k for k in os.listdir(self.cache) if k.rsplit('-', 1)[0] == name]
+
+
+registry = Registry()
+registry.register('sp500', '^GSPC.csv')
+registry.register('nasdaq', 'NASDAQCOM.csv', recipe=_nasdaq)
+registry.register('hashrate', 'data/btc_hash_rate.csv', column='Hash Rate')
+
+load = registry.load
+series = registry.series
+log_returns = registry.log_returns
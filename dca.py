@@ -0,0 +1,101 @@
+'''Dollar cost averaging (DCA) against buying everything at once (lump sum), for every start date.
+
+A DCA schedule buys an equal amount every days_between days, periods times. Its return from a
+start date is the average of the returns to the last price of each of its buys. With the prices on
+a daily calendar the buys from every start date are at fixed strides in the price array, so a whole
+grid of schedules is worked out with shifted views of one array instead of looping over dates.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def dca_grid(prices, periods=(12,), days_between=(30,)):
+    '''Lump sum and DCA returns for every start date and every schedule in the grid
+
+    Params
+    ------
+    prices: series of daily prices with a datetime index. Missing days are left as gaps
+        (NaN) rather than filled, so schedules that buy on a missing day give NaN
+    periods: list with the number of buys in each schedule
+    days_between: list with the number of days between buys
+
+    Returns
+    -------
+    (dates, lump_sum, dca, diffs) where dates is the daily index, lump_sum an array (dates,) of the return
+    from buying everything on each date, dca an array (periods, days_between, dates) of the DCA returns and
+    diffs the same shape with the annualised DCA return less the annualised lump sum return in %.
+    Start dates without room for the whole schedule before the last date are NaN, as are the
+    last date's lump sum and diffs
+    '''
+
+    prices = prices.dropna().asfreq('D')
+    dates = prices.index
+    price = prices.values.astype(np.float64)
+    n = len(price)
+    periods = [int(p) for p in periods]
+    days_between = [int(k) for k in days_between]
+
+    lump_sum = price[-1] / price - 1
+    years = (dates[-1] - dates).days.values / 365.25
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lump_sum_pa = (lump_sum + 1) ** (1 / years) - 1
+
+    max_periods = max(periods)
+    # Buys past the end of the array read NaN padding, those start dates are masked anyway
+    padded = np.concatenate([lump_sum, np.full(max_periods * max(days_between), np.nan)])
+    starts = np.arange(n)
+    wanted = dict((p, i) for i, p in enumerate(periods))
+
+    dca = np.full((len(periods), len(days_between), n), np.nan)
+    for j, k in enumerate(days_between):
+        total = np.zeros(n)
+        for buy in range(max_periods):
+            total += padded[buy * k:buy * k + n] # return of the (buy+1)th purchase for every start date
+            p = buy + 1
+            if p in wanted:
+                # the whole schedule has to fit before the last date
+                dca[wanted[p], j] = np.where(starts + p * k < n - 1, total / p, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diffs = ((dca + 1) ** (1 / years) - 1 - lump_sum_pa) * 100
+    lump_sum[-1] = np.nan
+
+    return dates, lump_sum, dca, diffs
+
+
+def dca_frame(prices, periods=(12,), days_between=(30,)):
+    '''Tidy frame of lump sum against DCA for every start date, schedule and asset
+
+    Params
+    ------
+    prices: series of daily prices, or a dataframe with a column of prices for each asset
+    periods: list with the number of buys in each schedule
+    days_between: list with the number of days between buys
+
+    Returns
+    -------
+    DataFrame with columns Asset (dataframes only), Periods, Days_between, Date, Lump_sum and DCA (returns
+    as fractions, like the dollar_cost_averaging notebook), Diff_pa (annualised DCA less lump sum in %)
+    and DCA_better. Start dates without a full schedule are left out
+    '''
+
+    if isinstance(prices, pd.DataFrame):
+        frames = []
+        for asset in prices.columns:
+            df = dca_frame(prices[asset], periods=periods, days_between=days_between)
+            df.insert(0, 'Asset', asset)
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    dates, lump_sum, dca, diffs = dca_grid(prices, periods=periods, days_between=days_between)
+    p, k, d = np.nonzero(~np.isnan(dca))
+    df = pd.DataFrame({'Periods': np.asarray(list(periods))[p],
+                       'Days_between': np.asarray(list(days_between))[k],
+                       'Date': dates.values[d],
+                       'Lump_sum': lump_sum[d],
+                       'DCA': dca[p, k, d],
+                       'Diff_pa': diffs[p, k, d]},
+                      columns=['Periods', 'Days_between', 'Date', 'Lump_sum', 'DCA', 'Diff_pa'])
+    df['DCA_better'] = df['DCA'] > df['Lump_sum']
+    return df
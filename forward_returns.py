@@ -0,0 +1,119 @@
+'''Forward returns over several horizons for one or more assets, as one dates x horizons x assets matrix.
+
+The bitcoin_rolling_returns notebook works out (Last.shift(-365) / Last - 1) for one horizon at a time.
+Here every horizon is read out of the log price array in one go and the summaries (share of negative
+returns per year, quantiles per horizon) are reductions over the matrix.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class ForwardReturns(object):
+    '''Forward returns for every date, horizon and asset
+
+    Params
+    ------
+    prices: series of prices, or a dataframe with a column of prices for each asset
+    horizons: list of horizons in bars (days for daily prices)
+
+    The forward log returns are in the log_returns attribute, an array (dates, horizons, assets).
+    Returns that run past the last date are NaN
+    '''
+
+    def __init__(self, prices, horizons=(30, 90, 180, 365, 730)):
+        if isinstance(prices, pd.Series):
+            prices = prices.to_frame()
+        self.dates = prices.index
+        self.horizons = [int(h) for h in horizons]
+        self.assets = list(prices.columns)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_prices = np.log(prices.values.astype(np.float64))
+        n = len(log_prices)
+        padded = np.concatenate([log_prices, np.full((max(self.horizons), len(self.assets)), np.nan)])
+        # row t + h of the padded log prices for every date t and horizon h
+        ahead = padded[np.arange(n)[:, None] + np.asarray(self.horizons)]
+        self.log_returns = ahead - log_prices[:, None, :]
+
+    def returns(self):
+        '''Forward returns in % as an array (dates, horizons, assets)'''
+        return (np.exp(self.log_returns) - 1) * 100
+
+    def frame(self, asset=None):
+        '''Forward returns in % for one asset as a DataFrame with a column per horizon'''
+        a = 0 if asset is None else self.assets.index(asset)
+        return pd.DataFrame(self.returns()[:, :, a], index=self.dates, columns=self.horizons)
+
+    def count_negative(self, by='year'):
+        '''Number of dates in each period where the forward return is negative
+
+        Params
+        ------
+        by: 'year', 'month' or an array of group labels, one per date
+
+        Returns
+        -------
+        DataFrame with a row per group and a column per horizon (per asset and horizon for several assets)
+        '''
+        negative, _, labels = self._grouped(by)
+        return self._table(negative, labels)
+
+    def share_negative(self, by='year'):
+        '''Share (%) of the dates in each period with a negative forward return, out of those where it is known
+
+        Params
+        ------
+        by: 'year', 'month' or an array of group labels, one per date
+
+        Returns
+        -------
+        DataFrame with a row per group and a column per horizon (per asset and horizon for several assets)
+        '''
+        negative, known, labels = self._grouped(by)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._table(negative / known.astype(np.float64) * 100, labels)
+
+    def quantiles(self, q=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        '''Quantiles of the forward returns (%) for each horizon
+
+        Returns
+        -------
+        DataFrame with a row per horizon (per asset and horizon for several assets) and a column per quantile
+        '''
+        with np.errstate(invalid='ignore'):
+            values = (np.exp(np.nanquantile(self.log_returns, q, axis=0)) - 1) * 100 # (q, horizons, assets)
+        if len(self.assets) == 1:
+            return pd.DataFrame(values[:, :, 0].T, index=pd.Index(self.horizons, name='Horizon'), columns=list(q))
+        index = pd.MultiIndex.from_product([self.assets, self.horizons], names=['Asset', 'Horizon'])
+        return pd.DataFrame(values.transpose(2, 1, 0).reshape(-1, len(q)), index=index, columns=list(q))
+
+    def _grouped(self, by):
+        '''Counts of negative and known returns for each run of equal labels
+
+        Return:
+        (negative, known, labels) with the counts as arrays (groups, horizons, assets)
+        '''
+        if isinstance(by, str) and by == 'year':
+            labels = np.asarray(self.dates.year)
+        elif isinstance(by, str) and by == 'month':
+            labels = np.asarray(self.dates.year * 100 + self.dates.month)
+        else:
+            labels = np.asarray(by)
+
+        # Sorting the labels makes each group a run of rows, reduceat then sums each run
+        order = np.argsort(labels, kind='mergesort')
+        labels = labels[order]
+        starts = np.concatenate([[0], np.flatnonzero(labels[1:] != labels[:-1]) + 1])
+        log_returns = self.log_returns[order]
+        known = (~np.isnan(log_returns)).astype(np.int64)
+        with np.errstate(invalid='ignore'):
+            negative = (log_returns < 0).astype(np.int64)
+        return (np.add.reduceat(negative, starts, axis=0), np.add.reduceat(known, starts, axis=0), labels[starts])
+
+    def _table(self, values, labels):
+        index = pd.Index(labels, name='Group')
+        if len(self.assets) == 1:
+            return pd.DataFrame(values[:, :, 0], index=index, columns=self.horizons)
+        columns = pd.MultiIndex.from_product([self.assets, self.horizons], names=['Asset', 'Horizon'])
+        return pd.DataFrame(values.transpose(0, 2, 1).reshape(len(labels), -1), index=index, columns=columns)
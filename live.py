@@ -0,0 +1,246 @@
+'''Live signals: keep a registry of strategies up to date from a feed of bars in one asyncio event loop.
+
+A feed is anything with an async bars() generator yielding (symbol, bars) where bars is a DataFrame
+of new rows with a datetime index and a 'last' column (plus 'volume', 'high' ... if strategies need them).
+ReplayFeed replays our HDF / CSV files, BitmexFeed polls the exchange with bitmex_utils.get_last (and backfills
+any bars a late poll missed).
+
+Every strategy is brought up to date with Backtester.append, which only works out the new rows,
+so hundreds of strategies can share one loop. The loop hands control back to the feed between
+strategies so it is never held up by a long batch of updates.
+'''
+
+import asyncio
+import shutil
+import tempfile
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+
+
+def _bars(frame):
+    '''New bars in the shape Backtester.append wants, the close is used as the last price'''
+    if isinstance(frame, pd.Series):
+        return frame.to_frame('last')
+    if 'last' not in frame.columns and 'close' in frame.columns:
+        frame = frame.rename(columns={'close': 'last'})
+    return frame
+
+
+class ReplayFeed(object):
+    '''Replay stored bars as if they were arriving live
+
+    Params
+    ------
+    frames: dict of symbol -> dataframe (or series of prices) with a datetime index
+    start: only bars after this date are replayed, strategies are expected to hold the earlier ones
+    batch: number of bars sent in each update
+    interval: seconds to wait between updates, 0 to replay as fast as possible
+    '''
+
+    def __init__(self, frames, start=None, batch=1, interval=0):
+        self._frames = dict((symbol, _bars(frame)) for symbol, frame in frames.items())
+        if start is not None:
+            self._frames = dict((symbol, frame[frame.index > start]) for symbol, frame in self._frames.items())
+        self._batch = batch
+        self._interval = interval
+
+    @classmethod
+    def from_hdf(cls, path, keys, **kwargs):
+        '''Replay keys of an HDF store e.g. ReplayFeed.from_hdf('bitmex', ['XBTUSD', 'XBTUSD_1h'])'''
+        return cls(dict((key, pd.read_hdf(path, key)) for key in keys), **kwargs)
+
+    @classmethod
+    def from_csv(cls, paths, **kwargs):
+        '''Replay CSV files, a dict of symbol -> path, with the dates in the first column'''
+        return cls(dict((symbol, pd.read_csv(path, index_col=0, parse_dates=True)) for symbol, path in paths.items()),
+                   **kwargs)
+
+    async def bars(self):
+        # Bars from every symbol come out in date order
+        frames = [(symbol, frame) for symbol, frame in self._frames.items() if len(frame)]
+        dates = np.concatenate([frame.index.values for _, frame in frames]) if frames else np.array([])
+        owner = np.concatenate([np.full(len(frame), i) for i, (_, frame) in enumerate(frames)]) if frames else dates
+        order = np.argsort(dates, kind='mergesort')
+        sent = [0] * len(frames)
+        for i in range(0, len(order), self._batch):
+            counts = np.bincount(owner[order[i:i + self._batch]].astype(int), minlength=len(frames))
+            for j in np.flatnonzero(counts):
+                symbol, frame = frames[j]
+                yield symbol, frame.iloc[sent[j]:sent[j] + counts[j]]
+                sent[j] += counts[j]
+            await asyncio.sleep(self._interval)
+
+
+class BitmexFeed(object):
+    '''Poll bitmex for new bars
+
+    Params
+    ------
+    utils: a bitmex_utils instance
+    symbols: list of symbols e.g. ['XBTUSD']
+    freq: bucket size, '1m', '5m', '1h' or '1d'
+    poll: seconds between polls
+    since: dict of symbol -> last date the strategies already have, bars up to it are skipped. If a poll
+        finds it more than a bar behind (a slow poll, a dropped connection) the missing bars are backfilled
+    '''
+
+    def __init__(self, utils, symbols=('XBTUSD',), freq='1h', poll=60, since=None):
+        self._utils = utils
+        self._symbols = list(symbols)
+        self._freq = freq
+        self._poll = poll
+        self._since = dict(since or {})
+
+    async def bars(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            for symbol in self._symbols:
+                # get_last blocks on the http request so it runs in a thread, the loop carries on
+                ohlc = await loop.run_in_executor(None, self._utils.get_last, symbol, 2, self._freq)
+                if ohlc is None or len(ohlc) == 0:
+                    continue
+                last = self._since.get(symbol)
+                if last is not None:
+                    step = self._utils.FREQS[self._freq]
+                    if ohlc.index[-1] - last > step: # bars were missed, fetch the whole gap
+                        try:
+                            ohlc = await loop.run_in_executor(None, self._backfill, symbol, last + step, ohlc.index[-1])
+                        except Exception: # tried again at the next poll
+                            continue
+                    ohlc = ohlc[ohlc.index > last]
+                if len(ohlc):
+                    self._since[symbol] = ohlc.index[-1]
+                    yield symbol, _bars(ohlc)
+            await asyncio.sleep(self._poll)
+
+    def _backfill(self, symbol, start, end):
+        '''Bars from start to end, with a checkpoint of its own so no other backfill's pages are touched'''
+        checkpoint = tempfile.mkdtemp(prefix='backfill_')
+        try:
+            return self._utils.backfill(symbol=symbol, freq=self._freq, start=start, end=end, save=False,
+                                        checkpoint=checkpoint)
+        finally:
+            shutil.rmtree(checkpoint, ignore_errors=True)
+
+
+class SignalDaemon(object):
+    '''Keep a registry of strategies up to date from a feed and publish their stances
+
+    Params
+    ------
+    feed: a feed with an async bars() generator, e.g. ReplayFeed or BitmexFeed
+    latencies: number of recent updates of each strategy kept for the latency metrics
+
+    Usage
+    -----
+    daemon = SignalDaemon(ReplayFeed({'XBTUSD': bars}, start='2018-01-01'))
+    daemon.register('ma_10_50', MABacktester(history, ms=10, ml=50), 'XBTUSD')
+    asyncio.run(daemon.run())
+    daemon.stances(), daemon.metrics()
+    '''
+
+    def __init__(self, feed, latencies=1000):
+        self._feed = feed
+        self._window = latencies
+        self._strategies = {}
+        self._symbols = {}
+        self._stances = {}
+        self._latencies = {}
+        self._updates = {}
+        self._errors = {}
+        self._subscribers = []
+        self._callbacks = []
+
+    def register(self, name, strategy, symbol):
+        '''Add a strategy that has already been given the history of symbol'''
+        if name in self._strategies:
+            raise ValueError('Strategy %s is already registered' % name)
+        strategy._run()
+        self._strategies[name] = strategy
+        self._symbols.setdefault(symbol, []).append(name)
+        self._latencies[name] = deque(maxlen=self._window)
+        self._updates[name] = 0
+        self._stances[name] = {'Strategy': name, 'Symbol': symbol, 'Date': strategy._df.index[-1],
+                               'Stance': strategy._df.array('stance')[-1], 'Latency': np.nan}
+
+    def unregister(self, name):
+        strategy = self._strategies.pop(name)
+        names = self._symbols[self._stances[name]['Symbol']]
+        if name in names: # not if it failed
+            names.remove(name)
+        for table in (self._stances, self._latencies, self._updates, self._errors):
+            table.pop(name, None)
+        return strategy
+
+    def subscribe(self, maxsize=0):
+        '''Queue which receives a dict (Strategy, Symbol, Date, Stance, Latency) for every update'''
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def on_update(self, callback):
+        '''Call callback(update) with the same dict as subscribe() for every update'''
+        self._callbacks.append(callback)
+
+    async def run(self, updates=None):
+        '''Process bars from the feed until it runs out, or after updates updates from the feed'''
+        count = 0
+        async for symbol, bars in self._feed.bars():
+            await self.update(symbol, bars, received=time.perf_counter())
+            count += 1
+            if updates is not None and count >= updates:
+                break
+
+    async def update(self, symbol, bars, received=None):
+        '''Append the bars to every strategy on symbol and publish the new stances
+
+        Latency is the time in seconds from receiving the bars to publishing each stance. A strategy that
+        fails may hold the bars without their stances, so it gets no more bars and its last good stance is
+        kept. The error is in metrics(), unregister it and register a rebuilt one to bring it back
+        '''
+        received = time.perf_counter() if received is None else received
+        for name in list(self._symbols.get(symbol, [])):
+            strategy = self._strategies[name]
+            try:
+                strategy.append(bars)
+                strategy._run()
+            except Exception as e: # one broken strategy must not stop the others
+                self._errors[name] = repr(e)
+                self._symbols[symbol].remove(name)
+                continue
+            latency = time.perf_counter() - received
+            self._latencies[name].append(latency)
+            self._updates[name] += 1
+            self._publish({'Strategy': name, 'Symbol': symbol, 'Date': strategy._df.index[-1],
+                           'Stance': strategy._df.array('stance')[-1], 'Latency': latency})
+            await asyncio.sleep(0) # let the feed and subscribers run
+
+    def _publish(self, update):
+        self._stances[update['Strategy']] = update
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait() # slow subscribers lose the oldest update
+            queue.put_nowait(update)
+        for callback in self._callbacks:
+            callback(update)
+
+    def stances(self):
+        '''DataFrame of the current stance of every strategy'''
+        return pd.DataFrame(list(self._stances.values()),
+                            columns=['Strategy', 'Symbol', 'Date', 'Stance', 'Latency']).set_index('Strategy')
+
+    def metrics(self):
+        '''DataFrame of the update latency (ms) of every strategy over its recent updates, the number
+        of updates and the last error if it has failed'''
+        rows = []
+        for name, latencies in self._latencies.items():
+            ms = np.array(latencies) * 1000
+            row = {'Strategy': name, 'Updates': self._updates[name], 'Error': self._errors.get(name)}
+            if len(ms):
+                row.update({'Mean_ms': ms.mean(), 'P50_ms': np.percentile(ms, 50), 'P95_ms': np.percentile(ms, 95),
+                            'Max_ms': ms.max()})
+            rows.append(row)
+        return pd.DataFrame(rows, columns=['Strategy', 'Updates', 'Mean_ms', 'P50_ms', 'P95_ms', 'Max_ms',
+                                           'Error']).set_index('Strategy')
@@ -0,0 +1,151 @@
+'''Monte Carlo simulation of future prices by bootstrapping historical returns.
+
+Paths are generated in chunks of sims x periods return matrices. Each chunk is folded into
+running summaries (a histogram of values per period for the quantile fan, and the last, min
+and max value of every path) and then thrown away, so a million paths never exist in memory
+at once. Every chunk has its own seed spawned from one SeedSequence, so a run is reproducible
+whatever the number of workers.
+'''
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+METHODS = ('iid', 'block', 'stationary')
+
+
+def bootstrap(returns, periods, sims=10000, method='iid', block=10, start=1.0, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+              chunk=10000, bins=2000, seed=None, workers=1, dates=None, log_returns=False):
+    '''Simulate price paths by resampling historical returns
+
+    Params
+    ------
+    returns: series or array of historical returns, NaNs are dropped
+    periods: number of periods in each simulated path
+    sims: number of paths
+    method: 'iid' draws each return independently, 'block' draws blocks of block returns in a row
+        (wrapping around the end of the history), 'stationary' draws blocks with random lengths
+        averaging block returns (Politis and Romano stationary bootstrap)
+    block: block length, or average block length for the stationary bootstrap
+    start: starting price of every path
+    quantiles: quantiles of the price for each period
+    chunk: number of paths simulated at a time, memory use is about 24 * chunk * periods bytes
+    bins: histogram bins per period used for the quantiles, they are accurate to within a bin
+    seed: int or SeedSequence, None for a random run
+    workers: number of processes to spread the chunks over
+    dates: optional index for the periods, e.g. pd.date_range('14 Apr 2018', '31 Dec 2018')
+    log_returns: True if returns are log returns, otherwise simple returns as from pct_change()
+
+    Returns
+    -------
+    (fan, paths) where fan is a DataFrame of the price quantiles for each period and paths a
+    DataFrame with the Last, Min and Max price of every simulated path
+    '''
+
+    if method not in METHODS:
+        raise ValueError('Method must be one of %s' % ', '.join(METHODS))
+    for name, value in (('sims', sims), ('chunk', chunk), ('workers', workers)):
+        if value < 1:
+            raise ValueError('%s must be at least 1' % name.capitalize())
+
+    returns = np.asarray(returns, dtype=np.float64)
+    returns = returns[~np.isnan(returns)]
+    if not log_returns:
+        returns = np.log1p(returns)
+
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    sizes = [min(chunk, sims - i) for i in range(0, sims, chunk)]
+    seeds = seed.spawn(len(sizes))
+
+    # The histogram range for each period comes from the first chunk, with room either side.
+    # Anything outside it is counted in the end bins.
+    first = _simulate(returns, periods, sizes[0], method, block, np.random.default_rng(seeds[0]))
+    low, high = first.min(axis=0), first.max(axis=0)
+    pad = np.maximum(high - low, 1e-8)
+    low, high = low - pad, high + pad
+    del first
+
+    tasks = [(returns, periods, method, block, low, high, bins, list(zip(sizes[i::workers], seeds[i::workers])))
+             for i in range(min(workers, len(sizes)))]
+    if len(tasks) == 1:
+        parts = [_summarise(tasks[0])]
+    else:
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            parts = pool.map(_summarise, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    counts = sum(p[0] for p in parts)
+    # chunk j was run by task j % len(tasks) as its (j // len(tasks))th chunk
+    ends = [None] * len(sizes)
+    for i, p in enumerate(parts):
+        for k, e in enumerate(p[1]):
+            ends[i + k * len(tasks)] = e
+    ends = np.concatenate(ends)
+
+    fan = pd.DataFrame(start * np.exp(_quantiles(counts, low, high, quantiles)),
+                       index=dates if dates is not None else pd.RangeIndex(1, periods + 1, name='Period'),
+                       columns=list(quantiles))
+    paths = pd.DataFrame(start * np.exp(ends), columns=['Last', 'Min', 'Max'])
+    return fan, paths
+
+
+def _simulate(returns, periods, sims, method, block, rng):
+    '''Cumulative log returns of sims paths as a sims x periods matrix'''
+
+    n = len(returns)
+    if method == 'iid':
+        index = rng.integers(0, n, size=(sims, periods))
+    elif method == 'block':
+        blocks = -(-periods // block)
+        starts = rng.integers(0, n, size=(sims, blocks))
+        index = (starts[:, :, None] + np.arange(block)).reshape(sims, blocks * block)[:, :periods] % n
+    else:
+        # A new block starts with probability 1 / block, otherwise carry on from the last return
+        steps = np.arange(periods)
+        new = rng.random((sims, periods)) < 1.0 / block
+        new[:, 0] = True
+        block_start = np.maximum.accumulate(np.where(new, steps, 0), axis=1)
+        starts = rng.integers(0, n, size=(sims, periods))
+        index = (np.take_along_axis(starts, block_start, axis=1) + steps - block_start) % n
+
+    paths = returns[index]
+    np.cumsum(paths, axis=1, out=paths)
+    return paths
+
+
+def _summarise(task):
+    '''Simulate a list of chunks and fold them into a histogram and the last / min / max of each path'''
+
+    returns, periods, method, block, low, high, bins, chunks = task
+    width = (high - low) / bins
+    offsets = np.arange(periods) * bins
+    counts = np.zeros(periods * bins, dtype=np.int64)
+    ends = []
+    for sims, seed in chunks:
+        paths = _simulate(returns, periods, sims, method, block, np.random.default_rng(seed))
+        ends.append(np.column_stack([paths[:, -1], paths.min(axis=1), paths.max(axis=1)]))
+        binned = np.clip(((paths - low) / width).astype(np.int64), 0, bins - 1)
+        binned += offsets
+        counts += np.bincount(binned.ravel(), minlength=periods * bins)
+    return counts.reshape(periods, bins), ends
+
+
+def _quantiles(counts, low, high, quantiles):
+    '''Quantiles for each period from the histogram, interpolating within the bin'''
+
+    periods, bins = counts.shape
+    width = (high - low) / bins
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1]
+    rows = np.arange(periods)
+    result = np.empty((periods, len(quantiles)))
+    for j, q in enumerate(quantiles):
+        target = q * total
+        k = np.argmax(cumulative >= target[:, None], axis=1)
+        before = np.where(k > 0, cumulative[rows, np.maximum(k - 1, 0)], 0)
+        inside = np.maximum(counts[rows, k], 1)
+        result[:, j] = low + (k + (target - before) / inside) * width
+    return result
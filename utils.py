@@ -5,6 +5,9 @@ import pandas as pd
 import pytz
 import sys
 import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 if sys.version_info > (3,0): 
     import bitmex
@@ -53,9 +56,14 @@ class bitmex_utils():
     ''' Utility class for loading data from bitmex
     api_key and api_secret need to be stored in environment variables as BITMEX_API_KEY and BITMEX_API_SECRET
     '''
-    def __init__(self):
-        api_key, api_secret = os.environ['BITMEX_API_KEY_TEST'], os.environ['BITMEX_API_SECRET_TEST']
-        self.client = bitmex.bitmex(test=True, api_key=api_key, api_secret=api_secret)
+    FREQS = {'1m': pd.Timedelta(minutes=1), '5m': pd.Timedelta(minutes=5), '1h': pd.Timedelta(hours=1), '1d': pd.Timedelta(days=1)}
+
+    def __init__(self, client=None):
+        '''client: optional bitmex client, or any object with the same Trade.Trade_getBucketed, e.g. a local fake'''
+        if client is None:
+            api_key, api_secret = os.environ['BITMEX_API_KEY_TEST'], os.environ['BITMEX_API_SECRET_TEST']
+            client = bitmex.bitmex(test=True, api_key=api_key, api_secret=api_secret)
+        self.client = client
 
     def get_last(self,symbol='XBTUSD',n=1,freq='1d'):
         ''' Get most recent n periods of data'''
@@ -72,14 +80,14 @@ class bitmex_utils():
         except:
             return None
 
-    def get_page(self,symbol='XBTUSD',n=1,freq='1d'):
-        PAGE_SIZE = 100
+    def get_page(self,symbol='XBTUSD',n=1,freq='1d',page_size=100):
+        ''' Get the nth page of page_size periods from the start of the data'''
         try:
             ohlcv_candles = pd.DataFrame(self.client.Trade.Trade_getBucketed(
                         binSize=freq,
                         symbol=symbol,
-                        count=PAGE_SIZE,
-                        start=PAGE_SIZE*(n-1)
+                        count=page_size,
+                        start=page_size*(n-1)
                         #reverse=True
                     ).result()[0])
             ohlcv_candles.set_index(['timestamp'], inplace=True)
@@ -87,17 +95,27 @@ class bitmex_utils():
         except:
             return None
 
-    def get_all(self,symbol='XBTUSD',freq='1d'):
-        '''Return the latest data. If any data is missing then get it first and save it.'''
+    def get_all(self,symbol='XBTUSD',freq='1d',store=None):
+        '''Return the latest data. If any data is missing then get it first and save it.
+
+        store: optional ColumnStore, the new rows are appended to it instead of rewriting the whole
+        HDF table. An empty store is backfilled from the start
+        '''
         
         name = symbol.replace('.','')
 
         if freq !='1d':
             name += '_' + freq
-        
-        ohlc = pd.read_hdf('bitmex',name)
 
-        last_date = ohlc.iloc[-1].name
+        if store is not None:
+            last_date = store.last_date(name)
+            if last_date is None:
+                self.backfill(symbol=symbol, freq=freq, store=store)
+                return store.read(name)
+        else:
+            ohlc = pd.read_hdf('bitmex',name)
+            last_date = ohlc.iloc[-1].name
+
         today = datetime.now(tz=pytz.utc) # timezone for bitmex is UTC
         days = (today - last_date).days
         hours = int((today - last_date).seconds / (60*60))
@@ -110,15 +128,155 @@ class bitmex_utils():
             raise ValueError('Freq of %s is not supported' % freq)
 
         if n > 0:
-            try:
-                ohlc = pd.concat([ohlc,self.get_last(n=n,symbol=symbol,freq=freq)],verify_integrity=True)
-            except:
-                pass
-            finally:
+            # the gap is filled a page at a time, failed requests are retried and then raise
+            new = self.backfill(symbol=symbol, freq=freq, start=last_date + self.FREQS[freq], save=False)
+            new = new[new.index > last_date]
+            if store is not None:
+                store.append(name, new)
+            elif len(new):
+                ohlc = pd.concat([ohlc,new],verify_integrity=True)
                 ohlc.to_hdf('bitmex',name,format='table')
 
+        return store.read(name) if store is not None else ohlc
+
+    def backfill(self,symbol='XBTUSD',freq='1h',start=None,end=None,page_size=1000,workers=4,rate=1.0,
+                 retries=5,backoff=1.0,checkpoint=None,save=True,store=None):
+        '''Fetch every bucket between two dates with concurrent page requests
+
+        The range is split into pages of page_size buckets by time, so every page can be requested on its own.
+        Pages are fetched by a pool of threads sharing one rate limit, each failed request is retried with
+        exponential backoff. Every finished page is written to the checkpoint directory straight away, so if the
+        backfill is stopped or a page keeps failing just run it again with the same start and only the
+        missing pages are fetched. Once every page is in, its file is removed, and the checkpoint too if no
+        other backfill has pages left in it.
+
+        Params
+        ------
+        symbol: e.g. 'XBTUSD'
+        freq: bucket size, '1m', '5m', '1h' or '1d'
+        start: first bucket (UTC), defaults to 2016-01-01
+        end: last bucket (UTC), defaults to now
+        page_size: buckets per request, bitmex allows up to 1000
+        workers: number of requests in flight at once
+        rate: requests per second across all workers
+        retries: number of retries of a failed request before giving up on the page
+        backoff: seconds before the first retry, doubled for every retry after that
+        checkpoint: directory for the finished pages, defaults to backfill_<name>
+        save: merge the result into the bitmex HDF store (as get_all does)
+        store: optional ColumnStore to append the result to instead of the HDF store
+
+        Returns
+        -------
+        Dataframe of the buckets indexed by timestamp. Raises RuntimeError, after the other pages have
+        finished, if any page still fails after its retries
+        '''
+
+        if freq not in self.FREQS:
+            raise ValueError('Freq of %s is not supported' % freq)
+        step = self.FREQS[freq]
+        start = pd.Timestamp(start if start is not None else '2016-01-01')
+        end = pd.Timestamp(end if end is not None else datetime.now(tz=pytz.utc))
+        start = start.tz_localize('UTC') if start.tz is None else start.tz_convert('UTC')
+        end = end.tz_localize('UTC') if end.tz is None else end.tz_convert('UTC')
+        if start > end:
+            raise ValueError('Start %s is after end %s' % (start, end))
+
+        name = symbol.replace('.','')
+        if freq !='1d':
+            name += '_' + freq
+        checkpoint = checkpoint or 'backfill_' + name
+        if not os.path.isdir(checkpoint):
+            os.makedirs(checkpoint)
+
+        # a page is the same request, and the same checkpoint file, whenever the backfill is run
+        pages = []
+        page_start = start
+        while page_start <= end:
+            pages.append((page_start, min(page_start + step * (page_size - 1), end)))
+            page_start += step * page_size
+        done = set(f[:-4] for f in os.listdir(checkpoint) if f.endswith('.csv'))
+        todo = [p for p in pages if _page_name(p) not in done]
+
+        limiter = _RateLimiter(rate)
+        def fetch(page):
+            page_start, page_end = page
+            for attempt in range(retries + 1):
+                limiter.wait()
+                try:
+                    rows = self.client.Trade.Trade_getBucketed(binSize=freq, symbol=symbol, count=page_size,
+                                                               startTime=page_start, endTime=page_end).result()[0]
+                    return page, pd.DataFrame(rows, columns=list(rows[0].keys()) if rows else ['timestamp'])
+                except Exception:
+                    if attempt == retries:
+                        raise
+                    time.sleep(backoff * 2 ** attempt)
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict((pool.submit(fetch, p), p) for p in todo)
+            for future in as_completed(futures):
+                try:
+                    page, rows = future.result()
+                except Exception as e:
+                    failed.append((futures[future], e))
+                    continue
+                # write then rename, a crash never leaves half a page behind
+                path = os.path.join(checkpoint, _page_name(page) + '.csv')
+                rows.to_csv(path + '.tmp', index=False)
+                os.replace(path + '.tmp', path)
+
+        if failed:
+            raise RuntimeError('%d of %d pages failed, run backfill again to resume. First error at %s: %r' % (
+                len(failed), len(pages), failed[0][0][0], failed[0][1]))
+
+        frames = [pd.read_csv(os.path.join(checkpoint, _page_name(p) + '.csv'), parse_dates=['timestamp']) for p in pages]
+        ohlc = pd.concat(frames, ignore_index=True).set_index('timestamp').sort_index()
+        ohlc = ohlc[~ohlc.index.duplicated(keep='last')]
+
+        if store is not None:
+            store.append(name, ohlc)
+        elif save:
+            if os.path.exists('bitmex'):
+                try:
+                    stored = pd.read_hdf('bitmex',name)
+                except KeyError:
+                    stored = None
+                if stored is not None:
+                    ohlc = pd.concat([stored[~stored.index.isin(ohlc.index)], ohlc]).sort_index()
+            ohlc.to_hdf('bitmex',name,format='table')
+        # every page is in ohlc (and saved), the last page's name changes with end so a later run could not use them.
+        # Pages of other backfills in the same checkpoint are left for them to resume from
+        for p in pages:
+            path = os.path.join(checkpoint, _page_name(p) + '.csv')
+            if os.path.exists(path):
+                os.remove(path)
+        if not os.listdir(checkpoint):
+            os.rmdir(checkpoint)
+
         return ohlc
 
+
+class _RateLimiter(object):
+    '''Spaces out calls from any number of threads to at most rate per second'''
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def _page_name(page):
+    '''Checkpoint file name for the page of buckets from page[0] to page[1]'''
+    return page[0].strftime('%Y%m%dT%H%M%S') + '_' + page[1].strftime('%Y%m%dT%H%M%S')
+
 def client(self):
 
     return self.client